@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import argparse
+import array
 import bitstring
 import random
 import re
@@ -9,83 +10,157 @@ import functools
 import datetime
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
+# The compiled inner loop, if build_core.py has been run.
+try:
+    from _algae_core import ffi as _core_ffi, lib as _core
+except ImportError:
+    _core = None
+
+import prng
 from constants import *
 
+assert array.array(WORD_TYPECODE).itemsize == WORD_BYTES
+
 class Interpreter(object):
     def __init__(self,cell=None,random_memory=False,memory=None,
-                 energy=None,ether=None,cell_soul=None):
+                 energy=None,ether=None,cell_soul=None,ether_base=0):
         if random_memory:
             # Generates random valid instructions.
             memory = []
             for i in range(MEMORY_WORDS):
                 memory.append(random_instruction())
-            memory = ''.join(memory)
 
         if cell is None:
             if memory is None:
-                memory = bitstring.BitStream(WORD_BITS * MEMORY_WORDS)
-            self.memory = bitstring.BitStream(memory)
+                memory = empty_memory()
+            self.memory = as_words(memory, copy=True)
 
             if energy is None:
                 energy = START_ENERGY
             self.energy = energy
             if cell_soul is None:
                 cell_soul = 0
-            self.cell_soul = cell_soul
+            self.cell_soul = as_soul(cell_soul)
 
         else:
-            self.memory = bitstring.BitStream(cell.memory)
+            # A memory kept in a memstore.MemoryStore is worked on where it
+            # is; anything else is worked on as a copy, until write_cell.
+            self.memory = as_words(cell.memory, copy=not isinstance(
+                cell.memory, memoryview))
             self.energy = cell.energy
             self.cell_soul = cell.soul
 
+        # The ether is MEMORY_WORDS words of ether, starting at ether_base.
+        # Usually a slice of the pond's EtherPool.
         if ether is None:
-            ether = {}
+            ether = empty_memory()
         self.ether = ether
+        self.ether_base = ether_base
 
         self.accumulator = 0
         self.pointer = 0
         self.direction = Direction.WEST
         self._start_energy = self.energy
+        # How many instructions this interpreter has run, and how many it
+        # may run before it's preempted.
+        self.instructions = 0
+        self.limit = sys.maxsize
+        # Opcode numbers to stop in front of, raising EventEnder, without
+        # running them.
+        self.stop_before = frozenset()
 
     def write_cell(self, cell):
         cell.memory = self.memory
         cell.energy = self.energy
 
+    def close(self):
+        # Done with for good. Only CoroutineInterpreter has anything to
+        # let go of.
+        pass
+
+    def get_state(self):
+        # Everything about this interpreter bar its ether, as plain values,
+        # to be handed to set_state on another one, maybe in another
+        # process.
+        return (self.memory, self.energy, self._start_energy, self.cell_soul,
+                self.accumulator, self.pointer, int(self.direction),
+                self.instructions)
+
+    def set_state(self, state):
+        (self.memory, self.energy, self._start_energy, self.cell_soul,
+         self.accumulator, self.pointer, direction,
+         self.instructions) = state
+        self.direction = Direction[direction]
+
     def __call__(self, verbose=False):
         self._verbose = verbose
-
-        self.memory.pos = self.pointer * WORD_BITS
+        limit = self.limit
+        stop_before = self.stop_before
 
         while True:
-            try:
-                if self.energy <= 0:
-                    raise NoEnergyEnder
-                self._looplet()
-            except bitstring.ReadError:
+            if self.energy <= 0:
+                raise NoEnergyEnder
+            if self.pointer >= MEMORY_WORDS:
                 # Reading off the edge of the memory makes you stop.
                 raise FinishedBookEnder
-            finally:
-                self.pointer = (self.memory.pos // WORD_BITS)
+            if self.instructions >= limit:
+                raise PreemptEnder
+            if (stop_before and
+                    self.memory[self.pointer] >> OPCODE_SHIFT in stop_before):
+                raise EventEnder
+            if _core is not None and not verbose and self._run_core():
+                continue
+            self._looplet()
+
+    def _run_core(self):
+        # Run as far as the compiled loop can go; returns how many
+        # instructions that was.
+        if self.accumulator >= 2**64 or self.energy >= 2**62:
+            return 0
+        try:
+            memory = _core_ffi.from_buffer('uint32_t[]', self.memory)
+            ether = _core_ffi.from_buffer('uint32_t[]', self.ether)
+        except TypeError:
+            return 0
+
+        state = _core_ffi.new('struct core_state *')
+        state.energy = self.energy
+        state.accumulator = self.accumulator
+        state.pointer = self.pointer
+        state.direction = int(self.direction)
+        state.instructions = self.instructions
+        state.limit = min(self.limit, 2**62)
+
+        ran = _core.run_core(memory, ether + self.ether_base, state,
+                             _CORE_COSTS, _core_python(self.stop_before))
+        if ran:
+            self.energy = state.energy
+            self.accumulator = state.accumulator
+            self.pointer = state.pointer
+            if state.direction != self.direction:
+                self.direction = Direction[state.direction]
+            self.instructions = state.instructions
+        return ran
 
     def _get_word(self, word_index):
         assert word_index < MEMORY_WORDS
 
-        start_index = word_index * WORD_BITS
-        end_index = start_index + WORD_BITS
-        return self.memory[start_index:end_index]
+        return self.memory[word_index]
 
     def _set_word(self, word_index, value):
         assert word_index < MEMORY_WORDS
-        value %= 2**WORD_BITS
-
-        bits = bitstring.Bits(uint=value, length=WORD_BITS)
-        bit_index = word_index * WORD_BITS
 
-        _old_pos = self.memory.pos
-        self.memory.overwrite(bits, bit_index)
-        self.memory.pos = _old_pos
-
-        assert self._get_word(word_index).uint == value
+        self.memory[word_index] = value % MAX_INT
 
     def _get_value(self, address_mode, address):
         if address_mode == AddressMode.ACCUMULATOR:
@@ -96,15 +171,13 @@ class Interpreter(object):
             return address
         elif address_mode == AddressMode.INDIRECT:
             # Read the word at address, and take that as the index.
-            index = self._get_word(address).uint % 2**ADDRESS_SIZE
-            return self._get_word(index).uint
+            index = self._get_word(address) % 2**ADDRESS_SIZE
+            return self._get_word(index)
 
         else:
             # Lookup. The address is a word index.
-            # Lookup that word, and interpret it as an unsigned big endian
-            # integer.
-            word = self._get_word(address)
-            return word.uintbe
+            # Lookup that word, which is already an unsigned integer.
+            return self._get_word(address)
 
     def _set_value(self, address_mode, address, new_value):
         if address_mode == AddressMode.ACCUMULATOR:
@@ -119,10 +192,8 @@ class Interpreter(object):
 
     def _describe_current_instruction(self, colour=True):
         fmt = "{position} {word} {accumulator} {energy}"
-        position = "<POS #{:>4}>".format(self.memory.pos // WORD_BITS)
-        # pretty_print_word only peeks, so we don't have to worry about the
-        # memory position being changed.
-        word = pretty_print_word(self.memory)
+        position = "<POS #{:>4}>".format(self.pointer)
+        word = pretty_print_word(self.memory[self.pointer])
         accumulator = "<ACC #{:>10}>".format(self.accumulator)
         energy = "<ENERGY #{:>4}>".format(self.energy)
 
@@ -134,15 +205,12 @@ class Interpreter(object):
             description = self._describe_current_instruction()
             print(description)
 
-        fields = self.memory.readlist(INSTRUCTION_FORMAT)
-
+        word = self.memory[self.pointer]
+        self.pointer += 1
+        self.instructions += 1
 
-        opcode = fields[0]
         # Replace with the enum, good for debugging.
-        try:
-            opcode = Opcode[opcode]
-        except ValueError:
-            pass
+        opcode = OPCODE_LOOKUP[word >> OPCODE_SHIFT]
 
         self.energy -= OPCODE_COST.get(opcode, 1)
         # Attemtping to run an opcode that costs into the negatives doesn't
@@ -151,10 +219,10 @@ class Interpreter(object):
             self.energy = 0
             raise NoEnergyEnder
 
-        src_mode = AddressMode[fields[1]]
-        src_address = fields[2]
-        dest_mode = AddressMode[fields[3]]
-        dest_address = fields[4]
+        src_mode = (word >> SRC_MODE_SHIFT) & ADDRESS_MODE_MASK
+        src_address = (word >> SRC_ADDR_SHIFT) & ADDRESS_MASK
+        dest_mode = (word >> DEST_MODE_SHIFT) & ADDRESS_MODE_MASK
+        dest_address = (word >> DEST_ADDR_SHIFT) & ADDRESS_MASK
 
         src_value = self._get_value(src_mode, src_address)
         dest_value = self._get_value(dest_mode, dest_address)
@@ -177,8 +245,7 @@ class Interpreter(object):
             if opcode == Opcode.ZERO:
                 value = 0
             else:
-                bits = bitstring.Bits(uint=src_value, length=WORD_BITS)
-                value = (~bits).uint
+                value = src_value ^ (MAX_INT - 1)
             self._set_value(dest_mode, dest_address, value)
 
         elif opcode == Opcode.EXCHANGE:
@@ -201,7 +268,7 @@ class Interpreter(object):
                 destination = self._get_value(dest_mode, dest_address)
                 destination %= MEMORY_WORDS
 
-                self.memory.pos = destination * WORD_BITS
+                self.pointer = destination
 
         elif opcode == Opcode.SKIP or opcode == Opcode.SKIPLESS:
             # SKIP
@@ -218,9 +285,8 @@ class Interpreter(object):
             if skipping:
                 # Skipping the instruction can make us go off the end of
                 # memory, so treat it like we're finished.
-                try:
-                    self.memory.pos += WORD_BITS
-                except ValueError:
+                self.pointer += 1
+                if self.pointer > MEMORY_WORDS:
                     raise FinishedBookEnder
         elif opcode == Opcode.STOP:
             # That's it. Everything else is ignored.
@@ -246,9 +312,10 @@ class Interpreter(object):
             elif sniff_type == Scent.CHECKSUM:
                 answer = memory_checksum(self.memory)
             elif sniff_type == Scent.SOUL:
-                answer = self.cell_soul.uint
-            elif sniff_type == Scent.LIGHT_LEVEL:
-
+                # The soulless smell of nothing.
+                if self.cell_soul is not None:
+                    answer = self.cell_soul
+            elif sniff_type in POND_SCENTS:
                 raise SniffEnder(sniff_type, callback)
             #FIXME all other sniff types are currently unimplemented.
 
@@ -256,9 +323,7 @@ class Interpreter(object):
             self._set_value(dest_mode, dest_address, answer)
 
         elif opcode == Opcode.RANDOM:
-            seed = src_value
-            r = random.Random(src_value)
-            new_value = r.randint(0,MAX_INT - 1)
+            new_value = prng.random_word(src_value)
 
             self._set_value(dest_mode, dest_address, new_value)
         elif opcode == Opcode.FACE:
@@ -279,12 +344,13 @@ class Interpreter(object):
             # Technically, we should probably say that ether values that
             # haven't been written to are "undefined", but I'm lazy, so
             # we'll just say it's a 0.
-            ether_value = self.ether.get(ether_address,0)
+            ether_value = self.ether[self.ether_base + ether_address]
             self._set_value(dest_mode, dest_address, ether_value)
 
         elif opcode == Opcode.ETHERWRITE:
             # dest is where it's going, and src is where the value comes from
-            self.ether[dest_value % MEMORY_WORDS] = src_value
+            ether_address = dest_value % MEMORY_WORDS
+            self.ether[self.ether_base + ether_address] = src_value % MAX_INT
 
         elif opcode == Opcode.BASK:
             raise BaskEnder
@@ -332,8 +398,37 @@ for opcode in Opcode:
         value = 1
     OPCODE_COST[opcode] = value
 
+# Every possible opcode byte, mapped to its enum member if it has one.
+# Undefined opcodes stay as plain integers.
+OPCODE_LOOKUP = list(range(2**OPCODE_BITS))
+for opcode in Opcode:
+    OPCODE_LOOKUP[int(opcode)] = opcode
+
 del opcode
 
+if _core is not None:
+    _CORE_COSTS = _core_ffi.new('int8_t[]', [
+        OPCODE_COST.get(opcode_enum, 1) for opcode_enum in OPCODE_LOOKUP])
+    # What the compiled loop leaves to Python, for each stop_before and
+    # prng.compatible.
+    _core_python_tables = {}
+
+def _core_python(stop_before):
+    key = (stop_before, prng.compatible)
+    try:
+        return _core_python_tables[key]
+    except KeyError:
+        pass
+    leave = set(int(opcode) for opcode in ENVIRONMENT_OPCODES)
+    if prng.compatible:
+        # Its numbers come from Python's random.
+        leave.add(int(Opcode.RANDOM))
+    leave.update(stop_before)
+    table = _core_ffi.new('uint8_t[]', [int(opcode in leave)
+                                        for opcode in range(2**OPCODE_BITS)])
+    _core_python_tables[key] = table
+    return table
+
 class AlgaeEnder(Exception):
     pass
 
@@ -386,11 +481,61 @@ class NoEnergyEnder(AlgaeEnder):
 class FinishedBookEnder(AlgaeEnder):
     pass
 
+class PreemptEnder(AlgaeEnder):
+    # Not the cell's doing; it's run for as long as it's allowed to.
+    pass
+
+class EventEnder(AlgaeEnder):
+    # The next instruction is one of stop_before. It hasn't been run.
+    pass
+
 class LadarEnder(AlgaeEnder):
     def __init__(self, callback):
         super(LadarEnder, self).__init__(self)
         self.callback = callback
 
+class CoroutineInterpreter(Interpreter):
+    # An Interpreter that runs in a greenlet of its own. When it gets to
+    # something the pond has to see to, it hands the ender to whoever
+    # called it, where it's raised as usual, and waits. Calling it again
+    # carries on from where it was, in the middle of the instruction,
+    # rather than unwinding and starting back through __call__.
+    def __init__(self, *args, **kwargs):
+        if greenlet is None:
+            raise RuntimeError("coroutine interpreters need greenlet")
+        super(CoroutineInterpreter, self).__init__(*args, **kwargs)
+        self._greenlet = None
+
+    def __call__(self, verbose=False):
+        self._verbose = verbose
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = greenlet.greenlet(self._run)
+        self._greenlet.parent = greenlet.getcurrent()
+        ender = self._greenlet.switch()
+        # Not the greenlet's frames, which would keep it from being freed.
+        ender.__traceback__ = None
+        raise ender
+
+    def close(self):
+        # A greenlet waiting to be carried on with, that refers back to
+        # us, is never collected, so it has to be ended by hand.
+        if self._greenlet is not None:
+            self._greenlet.throw()
+            self._greenlet = None
+
+    def _run(self):
+        while True:
+            try:
+                Interpreter.__call__(self, self._verbose)
+            except AlgaeEnder as ender:
+                self._greenlet.parent.switch(ender)
+
+    def _looplet(self):
+        try:
+            Interpreter._looplet(self)
+        except AlgaeEnder as ender:
+            self._greenlet.parent.switch(ender)
+
 def compute_binary(opcode, src, dest):
     assert opcode in BINARY_OPCODES
 
@@ -423,69 +568,126 @@ def compute_binary(opcode, src, dest):
 
     return out % MAX_INT
 
-def pretty_print_word(input_stream):
-    fields = input_stream.peeklist(INSTRUCTION_FORMAT)
-    opcode, src_mode, src_addr, dest_mode, dest_addr = fields
-
-    values = {}
-
-    try:
-        opcode_enum = Opcode[opcode]
-        opcode_str = opcode_enum.name
-    except ValueError:
-        opcode_bits = bitstring.Bits(uint=opcode, length=OPCODE_BITS)
-        opcode_str = '0x{}'.format(opcode_bits.hex)
-
-    values['opcode'] = opcode_str
-
-    for address_type in ('src','dest'):
-        if address_type == 'src':
-            mode = AddressMode[src_mode]
-            addr = src_addr
-        else:
-            mode = AddressMode[dest_mode]
-            addr = dest_addr
-
-        if mode == AddressMode.ACCUMULATOR:
-            fmt = '<ACC>'
-        else:
-            fmt = '{symbol}{address}'
-
-        if mode == AddressMode.LITERAL:
-            symbol = '#'
-        elif mode == AddressMode.INDIRECT:
-            symbol = '@'
-        else:
-            symbol = '$'
-
-        values[address_type] = fmt.format(symbol=symbol, address=addr)
-
+def decode_word(word):
+    # The integer equivalent of reading INSTRUCTION_FORMAT.
+    return (word >> OPCODE_SHIFT,
+            (word >> SRC_MODE_SHIFT) & ADDRESS_MODE_MASK,
+            (word >> SRC_ADDR_SHIFT) & ADDRESS_MASK,
+            (word >> DEST_MODE_SHIFT) & ADDRESS_MODE_MASK,
+            (word >> DEST_ADDR_SHIFT) & ADDRESS_MASK)
+
+def encode_word(opcode, src_mode, src_addr, dest_mode, dest_addr):
+    return ((int(opcode) << OPCODE_SHIFT) |
+            (int(src_mode) << SRC_MODE_SHIFT) |
+            (src_addr << SRC_ADDR_SHIFT) |
+            (int(dest_mode) << DEST_MODE_SHIFT) |
+            (dest_addr << DEST_ADDR_SHIFT))
+
+# The disassembler formats each field from these tables, rather than
+# working each one out again for every word.
+_OPCODE_STRINGS = []
+for _opcode, _opcode_enum in enumerate(OPCODE_LOOKUP):
+    if _opcode_enum is _opcode:
+        _OPCODE_STRINGS.append('{:<11}'.format('0x{:02x}'.format(_opcode)))
+    else:
+        _OPCODE_STRINGS.append('{:<11}'.format(_opcode_enum.name))
+
+_OPERAND_SYMBOLS = {AddressMode.NORMAL: '$',
+                    AddressMode.LITERAL: '#',
+                    AddressMode.INDIRECT: '@'}
+# _OPERAND_STRINGS[mode][address], right aligned to five characters.
+_OPERAND_STRINGS = []
+for _mode in range(ADDRESS_MODE_MASK + 1):
+    if _mode == AddressMode.ACCUMULATOR:
+        _OPERAND_STRINGS.append(['<ACC>'] * (ADDRESS_MASK + 1))
+    else:
+        _OPERAND_STRINGS.append(['{:>5}'.format(_OPERAND_SYMBOLS[_mode] +
+                                                str(address))
+                                 for address in range(ADDRESS_MASK + 1)])
+
+del _opcode, _opcode_enum, _mode
+
+def _format_fields(opcode, src_mode, src_addr, dest_mode, dest_addr):
+    return (_OPCODE_STRINGS[opcode] +
+            _OPERAND_STRINGS[src_mode][src_addr] + ', ' +
+            _OPERAND_STRINGS[dest_mode][dest_addr])
+
+def pretty_print_word(word):
+    if hasattr(word, 'peek'):
+        # Streams are peeked at, so their position doesn't change.
+        word = word.peek('uint:{}'.format(WORD_BITS))
+    elif isinstance(word, bitstring.Bits):
+        word = word[:WORD_BITS].uint
+
+    return _format_fields(*decode_word(word))
+
+def interesting_length(memory):
+    # How many words of memory are worth showing: everything up to the
+    # last change, keeping one of the words that repeat to the end.
+    words = as_words(memory)
+    if numpy is not None:
+        words = numpy.frombuffer(words, dtype=numpy.uint32)
+        changes = numpy.flatnonzero(words[1:] != words[:-1])
+        if not len(changes):
+            return 1
+        return int(changes[-1]) + 2
+
+    last = words[-1]
+    length = len(words)
+    while length > 1 and words[length - 2] == last:
+        length -= 1
+    return length
+
+def disassemble(memory, length=None):
+    # The first length words of memory as lines of assembly, or its
+    # interesting_length words if length isn't given. The fields of every
+    # word are pulled out together, then each line is put together from
+    # the tables.
+    words = as_words(memory)
+    if length is None:
+        length = interesting_length(words)
+
+    if numpy is not None:
+        words = numpy.frombuffer(words, dtype=numpy.uint32)[:length]
+        fields = zip((words >> OPCODE_SHIFT).tolist(),
+                     ((words >> SRC_MODE_SHIFT) & ADDRESS_MODE_MASK).tolist(),
+                     ((words >> SRC_ADDR_SHIFT) & ADDRESS_MASK).tolist(),
+                     ((words >> DEST_MODE_SHIFT) & ADDRESS_MODE_MASK).tolist(),
+                     ((words >> DEST_ADDR_SHIFT) & ADDRESS_MASK).tolist())
+    else:
+        fields = (decode_word(word) for word in words[:length])
 
-    fmt = "{opcode:<11}{src:>5}, {dest:>5}"
-    return fmt.format(**values)
+    return [_format_fields(*field) for field in fields]
 
 def pretty_print_memory(input_memory, colour=True):
-    strings = []
-    stream = bitstring.ConstBitStream(input_memory)
-    while stream.pos < WORD_BITS * MEMORY_WORDS:
-        strings.append(pretty_print_word(stream, colour=colour))
-        stream.pos += WORD_BITS
-    trimmed = False
-    while strings[-1] == strings[-2]:
-        strings.pop()
-        trimmed = True
-    strings.append('...')
+    # colour is accepted for older callers, and ignored.
+    strings = disassemble(input_memory)
+    if len(strings) < MEMORY_WORDS:
+        strings.append('...')
 
     return '\n'.join(strings)
 
+def dump_genomes(genomes, output):
+    # Write the disassembly of many memories to the file output, each
+    # headed by a comment. genomes is an iterable of (name, memory).
+    count = 0
+    for name, memory in genomes:
+        length = interesting_length(memory)
+        output.write('# {} ({} of {} words, checksum 0x{:08x})\n'.format(
+            name, length, MEMORY_WORDS, memory_checksum(memory)))
+        output.write('\n'.join(disassemble(memory, length)))
+        output.write('\n\n')
+        count += 1
+    return count
+
 def interesting_until(strings):
     strings = list(strings)
-    while strings[-1] == strings[-2]:
+    while len(strings) > 1 and strings[-1] == strings[-2]:
         strings.pop()
     return len(strings)
 
 def multiline_parse(text):
-    memory = bitstring.BitStream(WORD_BITS * MEMORY_WORDS)
+    memory = empty_memory()
     references = {}
     line_number = 0
     codes = []
@@ -521,11 +723,9 @@ def multiline_parse(text):
         if type(dest_addr) == str:
             dest_addr = references[dest_addr]
 
-        bs = bitstring.pack(INSTRUCTION_FORMAT,
-                            opcode,
-                            src_mode, src_addr,
-                            dest_mode, dest_addr)
-        memory.overwrite(bs)
+        memory[i] = encode_word(opcode,
+                                src_mode, src_addr,
+                                dest_mode, dest_addr)
     return memory, len(codes)
 
 def line_parse(string, return_bitstring=False):
@@ -618,7 +818,9 @@ def _main(seed=None,verbose=False):
         # Ignore ending actiony things.
         reason = None
 
-    changes = (original_memory ^ i.memory).count(1)
+    changes = 0
+    for before, after in zip(original_memory, i.memory):
+        changes += bin(before ^ after).count('1')
     format1 = format2 = msg = ''
     if changes:
         format1 = '\033[1;32m'
@@ -632,7 +834,6 @@ def _main(seed=None,verbose=False):
     #print("{}{} bits difference{}{}".format(format1,changes,format2,msg))
 
 def random_instruction(random=random):
-    fmt = INSTRUCTION_FORMAT
     # Select opcode.
     opcode = random.choice(list(Opcode))
 
@@ -644,15 +845,57 @@ def random_instruction(random=random):
     src_addr = random.randint(0, MEMORY_WORDS - 1)
     dest_addr = random.randint(0, MEMORY_WORDS - 1)
 
-    bs = bitstring.pack(fmt, opcode, src_mode, src_addr, dest_mode, dest_addr)
-    return bs
+    return encode_word(opcode, src_mode, src_addr, dest_mode, dest_addr)
 
 def random_memory(random=random):
+    # A prng.Stream draws the whole memory at once.
+    try:
+        words = random.words
+    except AttributeError:
+        pass
+    else:
+        return words(MEMORY_WORDS)
+
     new_memory = bytearray()
     for i in range(WORD_BYTES * MEMORY_WORDS):
         new_memory.append(random.randint(0,255))
 
-    return bitstring.BitStream(bytes=new_memory)
+    return as_words(bytes(new_memory))
+
+def empty_memory():
+    return array.array(WORD_TYPECODE, [0]) * MEMORY_WORDS
+
+def as_words(memory, copy=False):
+    # Memories live as arrays of MEMORY_WORDS unsigned words. This takes
+    # anything that looks like a memory (bitstrings, big endian bytes, or
+    # a sequence of words) and hands back such an array. Short memories
+    # are padded out with zeroes. A memoryview of words, a slot in a
+    # memstore.MemoryStore, is handed back as it is, unless it's copied.
+    if isinstance(memory, array.array) and memory.typecode == WORD_TYPECODE:
+        if copy:
+            memory = memory[:]
+        words = memory
+    elif isinstance(memory, memoryview) and memory.format == WORD_TYPECODE:
+        if not copy:
+            return memory
+        words = array.array(WORD_TYPECODE, memory)
+    else:
+        if isinstance(memory, bitstring.Bits):
+            memory = memory.tobytes()
+        if isinstance(memory, (bytes, bytearray)):
+            count = len(memory) // WORD_BYTES
+            memory = struct.unpack('>{}I'.format(count),
+                                   bytes(memory[:count * WORD_BYTES]))
+        words = array.array(WORD_TYPECODE, memory)
+
+    if len(words) < MEMORY_WORDS:
+        words.extend([0] * (MEMORY_WORDS - len(words)))
+    assert len(words) == MEMORY_WORDS
+    return words
+
+def words_to_bytes(words):
+    # The inverse of as_words; big endian, like the instruction format.
+    return struct.pack('>{}I'.format(len(words)), *words)
 
 def random_soul(random=random):
     new_soul = bytearray()
@@ -660,23 +903,17 @@ def random_soul(random=random):
     for i in range(WORD_BYTES):
         new_soul.append(random.randint(0,255))
 
-    return bitstring.Bits(bytes=new_soul)
+    return struct.unpack('>I', bytes(new_soul))[0]
 
-def memory_checksum(memory):
-    # is a bytes.
-    if len(memory) == 4096:
-        pass
-    elif len(memory) == WORD_BITS * MEMORY_WORDS:
-        memory = memory.bytes
-    else:
-        assert False # unrecognised length TODO proper exception?
+def as_soul(soul):
+    # Souls are plain unsigned words. Older code handed them around as
+    # bitstrings of WORD_BITS, so those are still accepted.
+    if isinstance(soul, bitstring.Bits):
+        return soul.uint
+    return soul
 
-    sum = 0
-    for i in range(MEMORY_WORDS):
-        tup = struct.unpack('>I', memory[i * WORD_BYTES : (i + 1)*WORD_BYTES])
-        value = tup[0]
-        sum += value
-    return sum % MAX_INT
+def memory_checksum(memory):
+    return sum(as_words(memory)) % MAX_INT
 
 def _make_parser():
     parser = argparse.ArgumentParser()
@@ -703,10 +940,7 @@ def _parse(namespace):
     with open(namespace.file) as f:
         txt = f.read()
     memory, instructions = multiline_parse(txt)
-    words = []
-    for i in range(instructions):
-        words.append(pretty_print_word(memory[i*WORD_BITS:]))
-    print("\n".join(words))
+    print("\n".join(disassemble(memory, instructions)))
 
 def _thrash(namespace):
     seeds = ns.seeds
@@ -0,0 +1,230 @@
+/*
+ *  PondALGAE - A simulated networked life simulation
+ *  Copyright (C) 2013  Jack Edge
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation, either version 3 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  You should have received a copy of the GNU General Public License
+ *  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * The interpreter's inner loop, for the instructions that only touch the
+ * cell's own memory and ether. It runs until the next instruction is one
+ * it can't do, and leaves that to Interpreter._looplet; that goes for
+ * anything the pond has to see to, a LEFTSHIFT by more than a word (which
+ * raises), and RANDOM when prng.py is in compatible mode (its numbers then
+ * come from Python's random).
+ *
+ * Everything here has to match algae.py exactly; build_core.py --check
+ * runs the two side by side. Values are unsigned 64 bit, which agrees with
+ * Python's % MAX_INT wherever it's taken; Interpreter only comes here when
+ * the accumulator and energy fit.
+ */
+
+#include <stdint.h>
+
+#define MEMORY_WORDS 1024
+#define WORD_MASK 0xffffffffULL
+
+#define OPCODE_SHIFT 24
+#define SRC_MODE_SHIFT 22
+#define SRC_ADDR_SHIFT 12
+#define DEST_MODE_SHIFT 10
+#define DEST_ADDR_SHIFT 0
+#define ADDRESS_MODE_MASK 0x3
+#define ADDRESS_MASK 0x3ff
+
+#define MODE_NORMAL 0
+#define MODE_ACCUMULATOR 1
+#define MODE_LITERAL 2
+#define MODE_INDIRECT 3
+
+enum {
+    NOOP = 0x00, ADD = 0x01, SUBTRACT = 0x02, MULTIPLY = 0x03,
+    DIVIDE = 0x04, MODULO = 0x05, BAND = 0x06, BOR = 0x07, BXOR = 0x08,
+    LEFTSHIFT = 0x09, RIGHTSHIFT = 0x0a, EXCHANGE = 0x0b, BINVERT = 0x0c,
+    ZERO = 0x0d, JUMP = 0x0e, SKIP = 0x0f, SKIPLESS = 0x10, STOP = 0x11,
+    SNIFF = 0x12, RANDOM = 0x13, FACE = 0x14, LADAR = 0x15,
+    ETHERREAD = 0x16, ETHERWRITE = 0x17, COPY = 0x1f
+};
+
+struct core_state {
+    int64_t energy;
+    uint64_t accumulator;
+    int64_t pointer;
+    int64_t direction;
+    int64_t instructions;
+    int64_t limit;
+};
+
+static uint64_t get_value(uint32_t *memory, struct core_state *s,
+                          int mode, int address)
+{
+    switch (mode) {
+    case MODE_ACCUMULATOR:
+        return s->accumulator;
+    case MODE_LITERAL:
+        return address;
+    case MODE_INDIRECT:
+        return memory[memory[address] % MEMORY_WORDS];
+    default:
+        return memory[address];
+    }
+}
+
+/* prng.random_word. */
+static uint64_t random_word(uint64_t seed)
+{
+    uint64_t z = seed + 0x9e3779b97f4a7c15ULL;
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return (z ^ (z >> 31)) >> 32;
+}
+
+static void set_value(uint32_t *memory, struct core_state *s,
+                      int mode, int address, uint64_t value)
+{
+    if (mode == MODE_ACCUMULATOR)
+        s->accumulator = value;
+    else if (mode != MODE_LITERAL)
+        /* Indirect writes go to the address itself, like the
+         * interpreter. */
+        memory[address] = (uint32_t)(value & WORD_MASK);
+}
+
+/*
+ * Returns how many instructions it ran. costs holds each opcode's energy
+ * cost; python marks the opcodes to leave to Python, including any in the
+ * interpreter's stop_before.
+ */
+int64_t run_core(uint32_t *memory, uint32_t *ether,
+                 struct core_state *s, const int8_t *costs,
+                 const uint8_t *python)
+{
+    int64_t ran = 0;
+
+    for (;;) {
+        uint32_t word;
+        int opcode, src_mode, src_address, dest_mode, dest_address;
+        uint64_t src, dest, result;
+        int writing = 1;
+
+        if (s->energy <= 0 || s->pointer >= MEMORY_WORDS ||
+                s->instructions >= s->limit)
+            return ran;
+
+        word = memory[s->pointer];
+        opcode = word >> OPCODE_SHIFT;
+        if (python[opcode])
+            return ran;
+
+        src_mode = (word >> SRC_MODE_SHIFT) & ADDRESS_MODE_MASK;
+        src_address = (word >> SRC_ADDR_SHIFT) & ADDRESS_MASK;
+        dest_mode = (word >> DEST_MODE_SHIFT) & ADDRESS_MODE_MASK;
+        dest_address = (word >> DEST_ADDR_SHIFT) & ADDRESS_MASK;
+
+        if (opcode == LEFTSHIFT &&
+                get_value(memory, s, dest_mode, dest_address) > WORD_MASK)
+            return ran;
+
+        s->pointer++;
+        s->instructions++;
+        ran++;
+
+        s->energy -= costs[opcode];
+        if (s->energy < 0) {
+            s->energy = 0;
+            return ran;
+        }
+
+        src = get_value(memory, s, src_mode, src_address);
+        dest = get_value(memory, s, dest_mode, dest_address);
+
+        switch (opcode) {
+        case COPY:
+            result = src;
+            break;
+        case ADD:
+            result = (src + dest) & WORD_MASK;
+            break;
+        case SUBTRACT:
+            result = (dest - src) & WORD_MASK;
+            break;
+        case DIVIDE:
+            result = src ? (dest / src) & WORD_MASK : WORD_MASK;
+            break;
+        case MODULO:
+            result = src ? (dest % src) & WORD_MASK : WORD_MASK;
+            break;
+        case BAND:
+            result = (src & dest) & WORD_MASK;
+            break;
+        case BOR:
+            result = (src | dest) & WORD_MASK;
+            break;
+        case BXOR:
+            result = (src ^ dest) & WORD_MASK;
+            break;
+        case LEFTSHIFT:
+            result = dest >= 32 ? 0 : (dest << dest) & WORD_MASK;
+            break;
+        case RIGHTSHIFT:
+            result = dest >= 64 ? 0 : (src >> dest) & WORD_MASK;
+            break;
+        case ZERO:
+            result = 0;
+            break;
+        case BINVERT:
+            result = src ^ WORD_MASK;
+            break;
+        case RANDOM:
+            result = random_word(src);
+            break;
+        case ETHERREAD:
+            result = ether[src % MEMORY_WORDS];
+            break;
+        case EXCHANGE:
+            set_value(memory, s, dest_mode, dest_address, src);
+            set_value(memory, s, src_mode, src_address, dest);
+            writing = 0;
+            break;
+        case ETHERWRITE:
+            ether[dest % MEMORY_WORDS] = (uint32_t)(src & WORD_MASK);
+            writing = 0;
+            break;
+        case JUMP:
+            if (src)
+                s->pointer = dest % MEMORY_WORDS;
+            writing = 0;
+            break;
+        case SKIP:
+        case SKIPLESS:
+            if (opcode == SKIP ? src == dest : src < dest)
+                /* Off the end is finished; the next go round sees it. */
+                s->pointer++;
+            writing = 0;
+            break;
+        case FACE:
+            s->direction = src % 8;
+            writing = 0;
+            break;
+        default:
+            /* NOOP, MULTIPLY (which isn't one of the binary opcodes yet)
+             * and everything undefined do nothing but cost. */
+            writing = 0;
+            break;
+        }
+
+        if (writing)
+            set_value(memory, s, dest_mode, dest_address, result);
+    }
+}
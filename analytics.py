@@ -0,0 +1,188 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import heapq
+
+import algae
+from constants import *
+
+# Energy is bucketed by bit length: bucket n holds energies from 2**(n-1)
+# up to 2**n - 1, and bucket 0 holds cells with none at all. Anything
+# past the last bucket goes in it.
+ENERGY_BUCKETS = 65
+
+def _energy_bucket(energy):
+    return min(energy.bit_length(), ENERGY_BUCKETS - 1)
+
+class Genome(object):
+    # One distinct memory, how many living cells carry it, and how often
+    # each opcode byte turns up in it. key is the memory's bytes, which
+    # it's kept under in Analytics.genomes.
+    __slots__ = ('memory', 'key', 'checksum', 'count', 'opcodes')
+
+    def __init__(self, memory, key):
+        self.memory = memory
+        self.key = key
+        self.checksum = algae.memory_checksum(memory)
+        self.count = 0
+        self.opcodes = [0] * 2**OPCODE_BITS
+        for word in memory:
+            self.opcodes[word >> OPCODE_SHIFT] += 1
+
+class Analytics(object):
+    # Totals over every living cell in a pond, kept up to date from the
+    # indexes the pond reports as changed, rather than by walking the pond.
+    # Each living index has a record of what it was counted as last time
+    # (genome, soul, energy); when it changes, the old record is taken away
+    # from the totals and the new one added.
+    #
+    # Queries bring the totals up to date first, which costs as much as the
+    # changes since the last query. Nothing here looks at the whole grid,
+    # except once when it's made.
+    def __init__(self, pond):
+        self.pond = pond
+        self.changed = pond.watch()
+
+        self.records = {}
+        # Keyed by the memory's bytes, so identical memories share one.
+        self.genomes = {}
+        # soul: [cells, energy]
+        self.souls = {}
+        self.opcodes = [0] * 2**OPCODE_BITS
+        self.energy_buckets = [0] * ENERGY_BUCKETS
+        self.population = 0
+        self.energy = 0
+
+        for index in pond.occupied:
+            self._add(index, pond.pond[index])
+
+    def close(self):
+        self.pond.unwatch(self.changed)
+
+    def _add(self, index, cell):
+        key = cell.memory.tobytes()
+        try:
+            genome = self.genomes[key]
+        except KeyError:
+            genome = self.genomes[key] = Genome(
+                array.array(WORD_TYPECODE, cell.memory), key)
+        genome.count += 1
+        if genome.count == 1:
+            opcodes = self.opcodes
+            for opcode, count in enumerate(genome.opcodes):
+                opcodes[opcode] += count
+
+        colony = self.souls.get(cell.soul)
+        if colony is None:
+            colony = self.souls[cell.soul] = [0, 0]
+        colony[0] += 1
+        colony[1] += cell.energy
+
+        self.energy_buckets[_energy_bucket(cell.energy)] += 1
+        self.population += 1
+        self.energy += cell.energy
+        # The genome, not the key, so cells with the same memory share it.
+        self.records[index] = (genome, cell.soul, cell.energy)
+
+    def _remove(self, index):
+        genome, soul, energy = self.records.pop(index)
+
+        genome.count -= 1
+        if not genome.count:
+            opcodes = self.opcodes
+            for opcode, count in enumerate(genome.opcodes):
+                opcodes[opcode] -= count
+            del self.genomes[genome.key]
+
+        colony = self.souls[soul]
+        colony[0] -= 1
+        colony[1] -= energy
+        if not colony[0]:
+            del self.souls[soul]
+
+        self.energy_buckets[_energy_bucket(energy)] -= 1
+        self.population -= 1
+        self.energy -= energy
+
+    def update(self):
+        changed = self.changed
+        pond = self.pond.pond
+        records = self.records
+        while changed:
+            index = changed.pop()
+            cell = pond[index]
+            record = records.get(index)
+            if not cell.alive:
+                if record is not None:
+                    self._remove(index)
+                continue
+
+            if record is not None:
+                genome, soul, energy = record
+                if (soul == cell.soul and energy == cell.energy and
+                    genome.memory == cell.memory):
+                    continue
+                self._remove(index)
+            self._add(index, cell)
+
+    # The opcode histogram counts each distinct live genome once, however
+    # many cells carry it; that's what says which instructions evolution
+    # is keeping around, rather than which colony is biggest.
+    def opcode_histogram(self):
+        # {opcode: words}, for the opcodes that turn up at all. Undefined
+        # opcodes are left as integers.
+        self.update()
+        return dict((algae.OPCODE_LOOKUP[opcode], count)
+                    for opcode, count in enumerate(self.opcodes) if count)
+
+    def distinct_genomes(self):
+        self.update()
+        return len(self.genomes)
+
+    def top_genomes(self, n=10):
+        # [(cells, checksum)] for the n most common genomes.
+        self.update()
+        return heapq.nlargest(n, ((genome.count, genome.checksum)
+                                  for genome in self.genomes.values()))
+
+    def top_colonies(self, n=10):
+        # [(cells, energy, soul)] for the n souls held by the most cells.
+        self.update()
+        return heapq.nlargest(n, ((cells, energy, soul)
+                                  for soul, (cells, energy)
+                                  in self.souls.items()))
+
+    def colony(self, soul):
+        # (cells, energy) held by soul.
+        self.update()
+        cells, energy = self.souls.get(algae.as_soul(soul), (0, 0))
+        return cells, energy
+
+    def energy_histogram(self):
+        # [(lowest energy in the bucket, cells)], for the non-empty buckets.
+        self.update()
+        return [(1 << (bucket - 1) if bucket else 0, count)
+                for bucket, count in enumerate(self.energy_buckets) if count]
+
+    def summary(self):
+        self.update()
+        return {
+            'population': self.population,
+            'energy': self.energy,
+            'souls': len(self.souls),
+            'genomes': len(self.genomes),
+        }
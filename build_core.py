@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+
+import argparse
+import array
+import os
+import random
+import sys
+import time
+
+# Builds _algae_core, the compiled inner loop for algae.Interpreter, from
+# algae_core.c. It's optional: without it (or without a compiler) the
+# interpreter runs in pure Python, as it always has, and gets the same
+# answers. Run with --check to compare the two: it runs random genomes
+# through both, with each kind of RANDOM, and exits non-zero if any
+# differ, so it can be run after every change to either.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CDEF = """
+struct core_state {
+    int64_t energy;
+    uint64_t accumulator;
+    int64_t pointer;
+    int64_t direction;
+    int64_t instructions;
+    int64_t limit;
+};
+
+int64_t run_core(uint32_t *memory, uint32_t *ether,
+                 struct core_state *s, const int8_t *costs,
+                 const uint8_t *python);
+"""
+
+def build():
+    import cffi
+    ffibuilder = cffi.FFI()
+    ffibuilder.cdef(CDEF)
+    with open(os.path.join(HERE, 'algae_core.c')) as f:
+        ffibuilder.set_source('_algae_core', f.read())
+    return ffibuilder.compile(tmpdir=HERE)
+
+def _random_interpreter(r, genomes, algae):
+    from constants import MEMORY_WORDS, WORD_BITS, WORD_TYPECODE, Direction
+    memory = array.array(WORD_TYPECODE, r.choice(genomes))
+    for i in range(r.randrange(4)):
+        memory[r.randrange(MEMORY_WORDS)] = algae.random_instruction(r)
+    ether = array.array(WORD_TYPECODE,
+                        [r.getrandbits(WORD_BITS) for i in range(8)] +
+                        [0] * (MEMORY_WORDS * 2 - 8))
+    interpreter = algae.Interpreter(ether=ether,
+                                    ether_base=r.choice([0, MEMORY_WORDS]))
+    energy = r.randint(1, 5000)
+    # Sometimes an accumulator that's been left holding more than a word.
+    accumulator = r.choice([0, r.getrandbits(WORD_BITS),
+                            r.getrandbits(WORD_BITS + 8)])
+    interpreter.set_state((memory, energy, energy, r.getrandbits(WORD_BITS),
+                           accumulator, 0, int(Direction.WEST), 0))
+    interpreter.limit = r.randint(1, 3000)
+    return interpreter
+
+def _run(interpreter):
+    # Run until it stops for good, passing over environment opcodes
+    # (there's no pond for them to act on). Returns what it finished with.
+    import algae
+    while True:
+        try:
+            interpreter()
+        except algae.EventEnder:
+            interpreter.pointer += 1
+            interpreter.instructions += 1
+            continue
+        except algae.AlgaeEnder as e:
+            ender = type(e).__name__
+            break
+        except Exception as e:
+            # A LEFTSHIFT by more than a word raises; both have to.
+            ender = type(e).__name__
+            break
+    return (ender, interpreter.get_state(), interpreter.ether)
+
+def check(seed, runs, genome_count):
+    import algae
+    from constants import ENVIRONMENT_OPCODES, OPCODE_SHIFT
+    if algae._core is None:
+        print("_algae_core isn't built")
+        return 1
+    core = algae._core
+
+    r = random.Random(seed)
+    genomes = []
+    for i in range(genome_count):
+        genome = algae.random_memory(r)
+        # Keep the environment out of most of it, as lockstep.py does.
+        for word_index, word in enumerate(genome):
+            if word >> OPCODE_SHIFT in ENVIRONMENT_OPCODES:
+                if r.random() < 0.95:
+                    genome[word_index] = word & ~(0xff << OPCODE_SHIFT)
+        genomes.append(genome)
+    stop_before = frozenset(int(opcode) for opcode in ENVIRONMENT_OPCODES)
+
+    failures = 0
+    python_time = core_time = 0.0
+    for run in range(runs):
+        interpreter = _random_interpreter(r, genomes, algae)
+        interpreter.stop_before = stop_before
+        twin = algae.Interpreter(ether=array.array(interpreter.ether.typecode,
+                                                   interpreter.ether),
+                                 ether_base=interpreter.ether_base)
+        state = interpreter.get_state()
+        twin.set_state((array.array(state[0].typecode, state[0]),) +
+                       state[1:])
+        twin.limit = interpreter.limit
+        twin.stop_before = stop_before
+
+        algae._core = None
+        start = time.time()
+        expected = _run(interpreter)
+        python_time += time.time() - start
+        algae._core = core
+        start = time.time()
+        got = _run(twin)
+        core_time += time.time() - start
+
+        if expected != got:
+            failures += 1
+            print("run {} differs".format(run))
+
+    print("{} runs, {} failures, python {:.3f}s, core {:.3f}s".format(
+        runs, failures, python_time, core_time))
+    return 1 if failures else 0
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description="Build the compiled interpreter core.")
+    parser.add_argument('--check',action='store_true',
+                        help="don't build; check the built core against "
+                        "the pure Python interpreter")
+    parser.add_argument('-s','--seed',type=int,default=0)
+    parser.add_argument('-r','--runs',type=int,default=2000)
+    parser.add_argument('-g','--genomes',type=int,default=8)
+    parser.add_argument('--compatible-random',action='store_true',
+                        help="only check RANDOM as it was before prng.py; "
+                        "otherwise it's checked both ways")
+    ns = parser.parse_args()
+
+    if ns.check:
+        import prng
+        # The same runs each way; RANDOM is the only thing that differs.
+        modes = [True] if ns.compatible_random else [False, True]
+        failed = 0
+        for compatible in modes:
+            prng.set_compatible(compatible)
+            print("RANDOM {}:".format(
+                "compatible" if compatible else "splitmix64"))
+            failed |= check(ns.seed, ns.runs, ns.genomes)
+        sys.exit(failed)
+    print(build())
+
+if __name__=='__main__':
+    _main()
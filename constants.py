@@ -26,6 +26,10 @@ MEMORY_WORDS = 1024
 ADDRESS_SIZE = int(math.log(MEMORY_WORDS, 2))
 START_ENERGY = 500
 NUMBER_OF_SUNS = 3
+# How many cells a LADAR beam travels before it gives up.
+LADAR_RANGE = 200
+# How many cells the sweeper looks at each tick, hunting for dead ones.
+SWEEP_BUDGET = 32
 SUN_MAX_BRIGHTNESS = 100000
 
 _light_fade_cache = {}
@@ -65,6 +69,26 @@ INSTRUCTION_FORMAT = (
 
 assert OPCODE_BITS + 2*ADDRESS_MODE_BITS + 2*ADDRESS_SIZE == WORD_BITS
 
+# The same layout as INSTRUCTION_FORMAT, but as shifts and masks, for
+# pulling fields straight out of an integer word.
+OPCODE_SHIFT = WORD_BITS - OPCODE_BITS
+SRC_MODE_SHIFT = OPCODE_SHIFT - ADDRESS_MODE_BITS
+SRC_ADDR_SHIFT = SRC_MODE_SHIFT - ADDRESS_SIZE
+DEST_MODE_SHIFT = SRC_ADDR_SHIFT - ADDRESS_MODE_BITS
+DEST_ADDR_SHIFT = DEST_MODE_SHIFT - ADDRESS_SIZE
+ADDRESS_MODE_MASK = 2**ADDRESS_MODE_BITS - 1
+ADDRESS_MASK = 2**ADDRESS_SIZE - 1
+
+assert DEST_ADDR_SHIFT == 0
+
+# Memories are arrays of unsigned words; this is the array typecode that
+# holds exactly one word.
+WORD_TYPECODE = 'I'
+
+# Energy can never go negative. Checking that on every write costs, so
+# running with python -O turns it off.
+VALIDATE_ENERGY = __debug__
+
 class Opcode(flufl.enum.IntEnum):
     # only have a defined enum member if there's actual behaviour defined.
     # with the humble exception of noop.
@@ -165,6 +189,38 @@ DIAGONAL_DIRECTIONS = (Direction.NORTHWEST,
                        Direction.SOUTHEAST,
                        Direction.SOUTHWEST)
 
+# How far a single step in each Direction moves you, indexed by direction.
+# North is towards y == 0.
+DX = (-1, -1,  0,  1, 1, 1, 0, -1)
+DY = ( 0, -1, -1, -1, 0, 1, 1,  1)
+
+class Boundary(flufl.enum.IntEnum):
+    # What lies past the edge of the pond.
+    HARD = 0 # Nothing. There is no cell there.
+    WRAP = 1 # The other side of the pond; it's a torus.
+    EDGESPACE = 2 # Nothing, and the cells near it are drained too.
+
+# How deep edgespace goes, and how much energy a cell loses every time it's
+# executed there, per cell it's in past the start of edgespace.
+EDGE_SPACE_WIDTH = 8
+EDGE_DRAIN = 5
+
+class Schedule(flufl.enum.IntEnum):
+    # How the pond picks which living cell to run each tick.
+    UNIFORM = 0 # Any of them, equally.
+    ENERGY = 1 # In proportion to their energy.
+    AGE = 2 # In proportion to how long their soul has held their place.
+
+# How many of the most recent ticks latency percentiles are taken over.
+LATENCY_WINDOW = 10000
+# The most instructions a cell runs in a worker process before coming back
+# to the pond, when running cells in parallel.
+PARALLEL_QUANTUM = 10000
+# How many cells a batch tick runs at most, by default. It's the same
+# however many processes there are, since it decides which cells are
+# picked, and so how a seeded pond goes.
+PARALLEL_BATCH = 32
+
 class Scent(flufl.enum.IntEnum):
     # I'm going to guess that sniffing for some of these scents are
     # more expensive, due to them involving more complex stuff.
@@ -174,7 +230,7 @@ class Scent(flufl.enum.IntEnum):
 
     SOUL = 2
     #BIRTH_POND_ID = 3
-    #CURRENT_POND_ID = 4
+    CURRENT_POND_ID = 4
     LIGHT_LEVEL = 5 # How much energy you'd get if you BASK
     #PASSIVE_LIGHT_THRESHOLD = 6
 
@@ -197,8 +253,8 @@ class Scent(flufl.enum.IntEnum):
     # Distances measurements are probably for the sake of the children,
     # be without the accompanying sqrt, to save time.
 
-    #SUN_DISTANCE = 12
-    #SUN_DIRECTION = 13
+    SUN_DISTANCE = 12
+    SUN_DIRECTION = 13
 
     #TRUNKPORT_DISTANCE = 14
     #TRUNKPORT_DIRECTION = 15
@@ -212,8 +268,8 @@ class Scent(flufl.enum.IntEnum):
     # Edgespace is somewhat lethal, in that you'll start losing energy
     # automatically, akin to being too close to the sun, but in reverse.
 
-    #EDGE_DISTANCE = 20
-    #EDGE_DIRECTION = 21
+    EDGE_DISTANCE = 20
+    EDGE_DIRECTION = 21
 
     # I suppose you could have "black holes", which have an edge border
 
@@ -221,8 +277,15 @@ class Scent(flufl.enum.IntEnum):
     # every time you're executed. If this is non zero, then edge sniffing,
     # as above, indicates the closest way back.
 
-    #EDGE_LEVEL = 22
+    EDGE_LEVEL = 22
+
 
+# Scents that depend only on where the sniffer is (see environment.py),
+# and every scent the pond has to answer rather than the interpreter.
+POSITION_SCENTS = (Scent.LIGHT_LEVEL, Scent.SUN_DISTANCE,
+                   Scent.SUN_DIRECTION, Scent.EDGE_DISTANCE,
+                   Scent.EDGE_DIRECTION, Scent.EDGE_LEVEL)
+POND_SCENTS = POSITION_SCENTS + (Scent.CURRENT_POND_ID,)
 
 class LadarAnswer(flufl.enum.IntEnum):
     EDGELINE = 1
@@ -239,4 +302,9 @@ UNARY_OPCODES = (Opcode.BINVERT, Opcode.ZERO)
 PRICEY_OPCODES = (Opcode.LADAR, Opcode.ETHERREAD, Opcode.ETHERWRITE,
                   Opcode.NUDGE, Opcode.HANDOFF, Opcode.MOVE, Opcode.PROCURE,
                   Opcode.BESTOW, Opcode.TEACH)
+# Opcodes that need the pond to answer or act on them. Up to the first of
+# these, a cell only touches its own memory and its soul's ether.
+ENVIRONMENT_OPCODES = (Opcode.SNIFF, Opcode.LADAR, Opcode.NUDGE, Opcode.TEACH,
+                       Opcode.BASK, Opcode.HANDOFF, Opcode.PROCURE,
+                       Opcode.BESTOW, Opcode.MOVE, Opcode.STOP)
 
@@ -16,8 +16,6 @@
 import sys
 import os
 import os.path
-import random
-import datetime
 import bitstring
 
 import pyglet
@@ -26,65 +24,45 @@ import pyglet.graphics
 import pyglet.gl
 import pyglet.app
 import pyglet.clock
+import pyglet.image
 
 import algae
-import pond
+import frames
 from constants import *
 
 class PondWindow(pyglet.window.Window):
-    light_visualise = False
+    # The pond runs flat out in its own process (see frames.simulate), and
+    # all the window does is show whichever frame it published last.
+    frame_rate = 30
 
     def __init__(self, *args, **kwargs):
+        simulation = kwargs.pop('simulation', {})
         super(PondWindow, self).__init__(*args, **kwargs)
 
-        self.pond = pond.Pond(size=self.get_size())
-        self.tick_counter = 0
-        self.last_draw = datetime.datetime.now()
+        self.process, self.frame = frames.start_simulation(self.get_size(),
+                                                           **simulation)
+        self.image = None
+        self.sequence = None
 
         self.fpses = []
 
-        pyglet.clock.schedule_interval(self.do_pond_things, 0.01)
-        pyglet.clock.set_fps_limit(1)
+        pyglet.clock.schedule_interval(self.fetch_frame,
+                                       1.0 / self.frame_rate)
 
-    def do_pond_things(self, dt):
-        self.pond.tick(self.tick_counter)
-        self.tick_counter += 1
-
-    def on_draw(self):
-        now = datetime.datetime.now()
-        dt = (now - self.last_draw).total_seconds()
-        if self.last_draw is not None and dt < 1.0:
+    def fetch_frame(self, dt):
+        if self.frame.sequence.value == self.sequence:
             return
+        data, self.sequence = self.frame.read()
+        width, height = self.get_size()
+        self.image = pyglet.image.ImageData(width, height, 'RGBA', data)
 
-        self.last_draw = now
+    def on_draw(self):
         self.clear()
-
-        for coord in self.pond.normal_space:
-            if coord in self.pond.pond:
-                cell = self.pond.pond[coord]
-            else:
-                cell = None
-            draw = False
-            if cell is not None and (cell.alive or cell.inanimate):
-                draw = True
-
-            if draw:
-                self._set_pixel(coord, cell.colour)
-            elif self.light_visualise:
-                light_level = self.pond.light_level[coord]
-
-                r = random.Random(light_level)
-
-                self._set_pixel(coord,
-                                tuple(r.randint(0,255) for i in range(4)))
+        if self.image is not None:
+            self.image.blit(0, 0)
 
         self.fpses.append(pyglet.clock.get_fps())
 
-    def _set_pixel(self, coord, colour):
-        pyglet.graphics.draw(1, pyglet.gl.GL_POINTS,
-                             ('v2i', coord),
-                             ('c4B', colour))
-
 if __name__=='__main__':
     import argparse
     parser = argparse.ArgumentParser()
@@ -94,18 +72,16 @@ if __name__=='__main__':
     parser.add_argument('--seed',type=int,default=0)
     ns = parser.parse_args()
 
-
-    window = PondWindow()
-    window.light_visualise = ns.light_visualise
-    pond = window.pond
-    pond._random.seed(ns.seed)
-
+    memories = []
     if ns.file is not None:
         with open(ns.file) as f:
             memory, size = algae.multiline_parse(f.read())
-            pond.spawn(memory=memory)
+            memories.append(memory)
 
-    window.pond._verbose = ns.verbose
+    simulation = {'seed': ns.seed, 'memories': memories,
+                  'verbose': ns.verbose,
+                  'light_visualise': ns.light_visualise}
+    window = PondWindow(simulation=simulation)
     pyglet.app.run()
 
     print sum(window.fpses) / float(len(window.fpses))
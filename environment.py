@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+
+import argparse
+import array
+import math
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from grid import Grid
+from constants import *
+
+# What a cell can smell about where it is, worked out ahead of time for
+# every index in the grid, one dense array per scent. SNIFF and BASK only
+# ever look a value up.
+#
+# Distances are squared, like the constants say, to save the sqrt.
+# Directions are the Direction that points most nearly towards the thing,
+# WEST if you're on top of it.
+#
+# Suns come and go, move and dim, so light is kept as a running sum of
+# every sun's share, and changing a sun takes its old share away and adds
+# its new one, only over the part of the pond it reaches. Each share is
+# rounded to a multiple of 1 / LIGHT_SCALE first. Sums of those are exact
+# in a double (for far more suns than a pond could hold), so taking a sun
+# away leaves exactly what was there before it, whatever order things
+# happen in. A cutoff, if there is one, is the radius a sun's light
+# reaches; without one it reaches the whole pond.
+#
+# numpy does the sums if it's there; it's the same arithmetic either way.
+
+LIGHT_SCALE = 2**20
+
+# The Direction for each eighth of a turn, anticlockwise from east, in
+# grid terms (y grows southwards).
+_BEARINGS = []
+for eighth in range(DIRECTIONS):
+    step = (int(round(math.cos(eighth * math.pi / 4))),
+            int(round(math.sin(eighth * math.pi / 4))))
+    _BEARINGS.append([d for d in range(DIRECTIONS)
+                      if (DX[d], DY[d]) == step][0])
+del eighth, step
+
+def bearing(dx, dy):
+    # The direction of (dx, dy) away.
+    if not dx and not dy:
+        return int(Direction.WEST)
+    eighths = int(round(math.atan2(dy, dx) / (math.pi / 4)))
+    return _BEARINGS[eighths % DIRECTIONS]
+
+def sun_light(distance_squared, brightness):
+    # One sun's share of the light, distance_squared away.
+    light = LIGHT_FADE(distance_squared) * (brightness /
+                                           float(SUN_MAX_BRIGHTNESS))
+    return round(light * LIGHT_SCALE) / float(LIGHT_SCALE)
+
+def edge_scents(grid, index):
+    # (EDGE_DISTANCE, EDGE_DIRECTION, EDGE_LEVEL) at index. The nearest
+    # edge wins; ties go west, north, east, south.
+    y, x = divmod(index, grid.width)
+    distance, direction = min((x, int(Direction.WEST)),
+                              (y, int(Direction.NORTH)),
+                              (grid.width - 1 - x, int(Direction.EAST)),
+                              (grid.height - 1 - y, int(Direction.SOUTH)))
+    return distance, direction, grid.edge_level(index)
+
+def nearest_sun(grid, suns, index):
+    # (sun, SUN_DISTANCE, SUN_DIRECTION) at index, for the nearest of suns,
+    # ties going to the lowest index; (-1, 0, WEST) if there are none.
+    best = (-1, 0, int(Direction.WEST))
+    y, x = divmod(index, grid.width)
+    for sun in sorted(suns):
+        sun_x, sun_y = grid.coord(sun)
+        dx = sun_x - x
+        dy = sun_y - y
+        distance_squared = dx * dx + dy * dy
+        if best[0] < 0 or distance_squared < best[1]:
+            best = (sun, distance_squared, bearing(dx, dy))
+    return best
+
+def sun_light_array(distance_squared, brightness, cutoff=None):
+    # sun_light over a numpy array of squared distances, with nothing past
+    # the cutoff.
+    # As LIGHT_FADE does it, with its 1 / 0 being 1.
+    shares = SUN_MAX_BRIGHTNESS * (1.0 / numpy.maximum(distance_squared, 1))
+    shares *= brightness / float(SUN_MAX_BRIGHTNESS)
+    shares = numpy.rint(shares * LIGHT_SCALE) / LIGHT_SCALE
+    if cutoff is not None:
+        shares[distance_squared > cutoff * cutoff] = 0
+    return shares
+
+class Environment(object):
+    def __init__(self, grid, cutoff=None):
+        self.grid = grid
+        self.cutoff = cutoff
+        area = grid.area
+        # {index: brightness}
+        self.suns = {}
+        self._light_sums = array.array('d', [0.0]) * area
+        self.light = array.array('I', [0]) * area
+        # The index of each index's nearest sun, -1 for none yet.
+        self.nearest_sun = array.array('i', [-1]) * area
+        self.sun_distance = array.array('I', [0]) * area
+        self.sun_direction = array.array('B', [0]) * area
+        self.edge_distance = array.array('I', [0]) * area
+        self.edge_direction = array.array('B', [0]) * area
+        self.edge_level = array.array('I', [0]) * area
+        self._edges()
+
+        # By plain int, which is what SNIFF has in hand.
+        self.tables = {
+            int(Scent.LIGHT_LEVEL): self.light,
+            int(Scent.SUN_DISTANCE): self.sun_distance,
+            int(Scent.SUN_DIRECTION): self.sun_direction,
+            int(Scent.EDGE_DISTANCE): self.edge_distance,
+            int(Scent.EDGE_DIRECTION): self.edge_direction,
+            int(Scent.EDGE_LEVEL): self.edge_level,
+        }
+
+    def _edges(self):
+        for index in range(self.grid.area):
+            (self.edge_distance[index], self.edge_direction[index],
+             self.edge_level[index]) = edge_scents(self.grid, index)
+
+    def scent(self, scent, index):
+        return self.tables[scent][index]
+
+    def add_sun(self, index, brightness=SUN_MAX_BRIGHTNESS):
+        if index in self.suns:
+            raise ValueError("there's already a sun at {}".format(index))
+        self.suns[index] = brightness
+        self._shine(index, brightness, 1)
+        self._nearest([index])
+
+    def remove_sun(self, index):
+        brightness = self.suns.pop(index)
+        self._shine(index, brightness, -1)
+        self._nearest(sorted(self.suns), self._forget_nearest(index))
+
+    def move_sun(self, index, new_index):
+        if new_index == index:
+            return
+        if new_index in self.suns:
+            raise ValueError("there's already a sun at {}".format(new_index))
+        brightness = self.suns.pop(index)
+        self._shine(index, brightness, -1)
+        self._nearest(sorted(self.suns), self._forget_nearest(index))
+        self.suns[new_index] = brightness
+        self._shine(new_index, brightness, 1)
+        self._nearest([new_index])
+
+    def set_brightness(self, index, brightness):
+        # Nearest suns stay where they are, however dim.
+        self._shine(index, self.suns[index], -1)
+        self.suns[index] = brightness
+        self._shine(index, brightness, 1)
+
+    def _window(self, index):
+        # The rectangle a sun at index lights, as x and y ranges.
+        grid = self.grid
+        sun_x, sun_y = grid.coord(index)
+        if self.cutoff is None:
+            return (0, grid.width), (0, grid.height)
+        return ((max(0, sun_x - self.cutoff),
+                 min(grid.width, sun_x + self.cutoff + 1)),
+                (max(0, sun_y - self.cutoff),
+                 min(grid.height, sun_y + self.cutoff + 1)))
+
+    def _shine(self, index, brightness, sign):
+        # Add (sign 1) or take away (sign -1) the light of a sun at index.
+        if numpy is not None:
+            return self._shine_numpy(index, brightness, sign)
+        sun_x, sun_y = self.grid.coord(index)
+        (x0, x1), (y0, y1) = self._window(index)
+        reach = None
+        if self.cutoff is not None:
+            reach = self.cutoff * self.cutoff
+        width = self.grid.width
+        sums = self._light_sums
+        light = self.light
+        for y in range(y0, y1):
+            row = y * width
+            dy = sun_y - y
+            for x in range(x0, x1):
+                dx = sun_x - x
+                distance_squared = dx * dx + dy * dy
+                if reach is not None and distance_squared > reach:
+                    continue
+                i = row + x
+                sums[i] += sign * sun_light(distance_squared, brightness)
+                light[i] = int(sums[i])
+
+    def _shine_numpy(self, index, brightness, sign):
+        grid = self.grid
+        sun_x, sun_y = grid.coord(index)
+        (x0, x1), (y0, y1) = self._window(index)
+        dx = numpy.arange(x0, x1, dtype=numpy.int64) - sun_x
+        dy = numpy.arange(y0, y1, dtype=numpy.int64) - sun_y
+        distance_squared = dy[:, None] ** 2 + dx[None, :] ** 2
+        shares = sun_light_array(distance_squared, brightness, self.cutoff)
+
+        shape = (grid.height, grid.width)
+        sums = numpy.frombuffer(self._light_sums, dtype=numpy.float64)
+        sums = sums.reshape(shape)[y0:y1, x0:x1]
+        light = numpy.frombuffer(self.light, dtype=numpy.uint32)
+        light = light.reshape(shape)[y0:y1, x0:x1]
+        if sign > 0:
+            sums += shares
+        else:
+            sums -= shares
+        light[...] = sums
+
+    def _nearest(self, suns, where=None):
+        # Bring the nearest sun (and its distance and direction) up to date
+        # at where, a list of indexes, or everywhere, by comparing against
+        # suns. Indexes with no nearest sun (-1) take the first one they
+        # see. Ties go to the sun with the lowest index, so it comes out
+        # the same whatever order suns turn up in.
+        if numpy is not None:
+            return self._nearest_numpy(suns, where)
+        width = self.grid.width
+        nearest = self.nearest_sun
+        sun_distance = self.sun_distance
+        sun_direction = self.sun_direction
+        if where is None:
+            where = range(self.grid.area)
+        for sun in suns:
+            sun_x, sun_y = self.grid.coord(sun)
+            for i in where:
+                y, x = divmod(i, width)
+                dx = sun_x - x
+                dy = sun_y - y
+                distance_squared = dx * dx + dy * dy
+                if (nearest[i] < 0 or distance_squared < sun_distance[i] or
+                        (distance_squared == sun_distance[i] and
+                         sun < nearest[i])):
+                    nearest[i] = sun
+                    sun_distance[i] = distance_squared
+                    sun_direction[i] = bearing(dx, dy)
+
+    def _nearest_numpy(self, suns, where):
+        width = self.grid.width
+        nearest = numpy.frombuffer(self.nearest_sun, dtype=numpy.int32)
+        sun_distance = numpy.frombuffer(self.sun_distance, dtype=numpy.uint32)
+        sun_direction = numpy.frombuffer(self.sun_direction,
+                                         dtype=numpy.uint8)
+        if where is None:
+            where = numpy.arange(self.grid.area, dtype=numpy.int64)
+        else:
+            where = numpy.array(where, dtype=numpy.int64)
+        ys, xs = numpy.divmod(where, width)
+        bearings = numpy.array(_BEARINGS, dtype=numpy.uint8)
+        for sun in suns:
+            sun_x, sun_y = self.grid.coord(sun)
+            dx = sun_x - xs
+            dy = sun_y - ys
+            distance_squared = dx * dx + dy * dy
+            current = nearest[where]
+            best = sun_distance[where].astype(numpy.int64)
+            nearer = ((current < 0) | (distance_squared < best) |
+                      ((distance_squared == best) & (sun < current)))
+            chosen = where[nearer]
+            eighths = numpy.rint(numpy.arctan2(dy[nearer], dx[nearer]) /
+                                 (math.pi / 4)).astype(numpy.int64)
+            ways = bearings[eighths % DIRECTIONS]
+            ways[distance_squared[nearer] == 0] = int(Direction.WEST)
+            nearest[chosen] = sun
+            sun_distance[chosen] = distance_squared[nearer]
+            sun_direction[chosen] = ways
+
+    def _forget_nearest(self, sun):
+        # Everywhere sun was nearest, as a list of indexes, now with no
+        # nearest sun at all.
+        if numpy is not None:
+            nearest = numpy.frombuffer(self.nearest_sun, dtype=numpy.int32)
+            where = numpy.flatnonzero(nearest == sun)
+            nearest[where] = -1
+            numpy.frombuffer(self.sun_distance, dtype=numpy.uint32)[where] = 0
+            numpy.frombuffer(self.sun_direction,
+                             dtype=numpy.uint8)[where] = int(Direction.WEST)
+            return where.tolist()
+        where = [i for i, nearest in enumerate(self.nearest_sun)
+                 if nearest == sun]
+        for i in where:
+            self.nearest_sun[i] = -1
+            self.sun_distance[i] = 0
+            self.sun_direction[i] = int(Direction.WEST)
+        return where
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def _main():
+    # How long changing a sun takes, on an empty grid.
+    global numpy
+    parser = argparse.ArgumentParser(description="Time sun updates.")
+    parser.add_argument('--size',type=_parse_size,default=(640,480))
+    parser.add_argument('-c','--cutoff',type=int,default=None,
+                        help="radius a sun's light reaches")
+    parser.add_argument('-n','--suns',type=int,default=NUMBER_OF_SUNS)
+    parser.add_argument('-r','--repeat',type=int,default=10)
+    parser.add_argument('--no-numpy',action='store_true')
+    ns = parser.parse_args()
+    if ns.no_numpy:
+        numpy = None
+
+    grid = Grid(ns.size)
+    environment = Environment(grid, cutoff=ns.cutoff)
+    width, height = ns.size
+    start = time.time()
+    for n in range(ns.suns):
+        environment.add_sun(grid.index(((n * 97) % width,
+                                        (n * 61) % height)))
+    per_sun = (time.time() - start) / max(1, ns.suns)
+
+    sun = min(environment.suns)
+    x, y = grid.coord(sun)
+    moved = grid.index(((x + 1) % width, y))
+    before = environment.light.tobytes()
+    dim = move = 0.0
+    for i in range(ns.repeat):
+        start = time.time()
+        environment.set_brightness(sun, SUN_MAX_BRIGHTNESS // 2)
+        environment.set_brightness(sun, SUN_MAX_BRIGHTNESS)
+        dim += (time.time() - start) / 2
+        start = time.time()
+        environment.move_sun(sun, moved)
+        environment.move_sun(moved, sun)
+        move += (time.time() - start) / 2
+
+    print("{}x{}, {} suns, cutoff {}, {}".format(
+        width, height, ns.suns, ns.cutoff,
+        "numpy" if numpy is not None else "pure Python"))
+    print("add {:.2f}ms, dim {:.2f}ms, move {:.2f}ms".format(
+        per_sun * 1e3, dim / ns.repeat * 1e3, move / ns.repeat * 1e3))
+    print("light after going back and forth: {}".format(
+        "unchanged" if environment.light.tobytes() == before
+        else "CHANGED"))
+
+if __name__=='__main__':
+    _main()
@@ -0,0 +1,101 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import algae
+from constants import *
+
+class EtherPool(object):
+    # Every ether in the pond, in one array of words. Each soul is given
+    # a small integer id, and its ether is the MEMORY_WORDS words starting
+    # at id * MEMORY_WORDS. The pond counts how many cells hold each soul;
+    # once nothing holds it, its ether is wiped and the id reused.
+    #
+    # Id 0 belongs to cells without a soul, and is never given back.
+    def __init__(self):
+        self.words = algae.empty_memory()
+        self.ids = {None: 0}
+        self.souls = [None]
+        self.counts = [0]
+        self._free_ids = []
+        self._dying = []
+
+    def __len__(self):
+        # How many souls have an ether, not counting the soulless.
+        return len(self.ids) - 1
+
+    def __contains__(self, soul):
+        return soul in self.ids
+
+    def intern(self, soul):
+        # The id of soul's ether, making one if it doesn't have one.
+        try:
+            return self.ids[soul]
+        except KeyError:
+            pass
+
+        if self._free_ids:
+            soul_id = self._free_ids.pop()
+            self.souls[soul_id] = soul
+            self.counts[soul_id] = 0
+        else:
+            soul_id = len(self.souls)
+            self.souls.append(soul)
+            self.counts.append(0)
+            self.words.extend(algae.empty_memory())
+        self.ids[soul] = soul_id
+        return soul_id
+
+    def base(self, soul):
+        # Where soul's ether starts in words.
+        return self.intern(soul) * MEMORY_WORDS
+
+    def ether(self, soul):
+        # A copy of soul's ether, for looking at.
+        start = self.base(soul)
+        return self.words[start:start + MEMORY_WORDS]
+
+    def retain(self, soul):
+        self.counts[self.intern(soul)] += 1
+
+    def release(self, soul):
+        soul_id = self.ids[soul]
+        self.counts[soul_id] -= 1
+        assert self.counts[soul_id] >= 0
+        if not self.counts[soul_id]:
+            # Not freed yet; a soul often passes through zero cells in the
+            # middle of a move or a nudge.
+            self._dying.append(soul_id)
+
+    def collect(self):
+        # Free the ethers of any souls that are still held by nobody.
+        dying, self._dying = self._dying, []
+        for soul_id in dying:
+            if self.counts[soul_id] or self.souls[soul_id] is None:
+                continue
+            del self.ids[self.souls[soul_id]]
+            self.souls[soul_id] = None
+            start = soul_id * MEMORY_WORDS
+            self.words[start:start + MEMORY_WORDS] = algae.empty_memory()
+            self._free_ids.append(soul_id)
+
+    def snapshot(self):
+        # Every live ether, as {soul: words}.
+        snapshot = {}
+        for soul, soul_id in self.ids.items():
+            if soul is not None:
+                start = soul_id * MEMORY_WORDS
+                snapshot[soul] = self.words[start:start + MEMORY_WORDS]
+        return snapshot
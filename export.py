@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+
+import argparse
+import struct
+import sys
+import zlib
+
+import algae
+import frames
+import pond as pond_module
+import prng
+from constants import *
+
+# Writes a pond out as a sequence of frames, without a window: either as
+# numbered PNGs, or as one raw RGBA stream that can be piped into a video
+# encoder, e.g.
+#
+#   ffmpeg -f rawvideo -pix_fmt rgba -s 640x480 -i pond.rgba pond.mp4
+#
+# Both are written top row first, so they look the same as the window.
+
+PIXEL_BYTES = frames.PIXEL_BYTES
+
+def _energy_colour(cell):
+    # Brighter for more energy, doubling per step.
+    level = min(255, cell.energy.bit_length() * 8)
+    return (level, level, level, 255)
+
+def _soul_colour(cell):
+    if cell.soul is None:
+        return (255, 255, 255, 255)
+    red, green, blue, alpha = bytearray(struct.pack('>I', cell.soul))
+    return (red, green, blue, 255)
+
+OVERLAYS = {
+    'colour': lambda cell: cell.colour,
+    'light': lambda cell: cell.colour,
+    'energy': _energy_colour,
+    'soul': _soul_colour,
+}
+
+class FrameExporter(object):
+    # Keeps its own copy of the frame, and only redraws the indexes the pond
+    # says have changed since the last frame, so a frame costs as much as
+    # the activity since the last one, not as much as the whole grid.
+    def __init__(self, pond, overlay='colour'):
+        self.pond = pond
+        self.width, self.height = pond.grid.size
+        self.overlay = OVERLAYS[overlay]
+
+        if overlay == 'light':
+            self.background = frames.light_texture(pond)
+        else:
+            self.background = bytearray(pond.grid.area * PIXEL_BYTES)
+
+        self.changed = pond.watch()
+        self.frame = bytearray(self.background)
+        for index in list(pond.pond):
+            self._draw(index)
+
+    def close(self):
+        self.pond.unwatch(self.changed)
+
+    def _draw(self, index):
+        cell = self.pond.pond[index]
+        offset = index * PIXEL_BYTES
+        end = offset + PIXEL_BYTES
+        if cell.alive or cell.inanimate:
+            self.frame[offset:end] = bytearray(self.overlay(cell))
+        else:
+            self.frame[offset:end] = self.background[offset:end]
+
+    def update(self):
+        changed = self.changed
+        while changed:
+            self._draw(changed.pop())
+        return self.frame
+
+    def rows(self):
+        # The frame's rows, top (the highest y) first.
+        stride = self.width * PIXEL_BYTES
+        for y in reversed(range(self.height)):
+            yield self.frame[y * stride:(y + 1) * stride]
+
+    def raw(self):
+        self.update()
+        return b''.join(bytes(row) for row in self.rows())
+
+    def png(self, level=6):
+        self.update()
+        scanlines = bytearray()
+        for row in self.rows():
+            # Each scanline starts with its filter type; 0 is no filter.
+            scanlines.append(0)
+            scanlines += row
+
+        # 8 bit RGBA, no interlacing.
+        header = struct.pack('>IIBBBBB', self.width, self.height,
+                             8, 6, 0, 0, 0)
+        return b''.join((b'\x89PNG\r\n\x1a\n',
+                         _png_chunk(b'IHDR', header),
+                         _png_chunk(b'IDAT',
+                                    zlib.compress(bytes(scanlines), level)),
+                         _png_chunk(b'IEND', b'')))
+
+def _png_chunk(kind, data):
+    checksum = zlib.crc32(kind + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I',
+                                                                   checksum)
+
+def export(pond, ticks, every, output, overlay='colour', format='png',
+           level=6):
+    # Run pond for ticks, writing a frame before the first tick and then
+    # every `every` ticks. For pngs, output is a pattern like
+    # 'frames/pond{:06d}.png' that's given the frame number; for raw, it's
+    # one file that every frame is appended to.
+    exporter = FrameExporter(pond, overlay=overlay)
+    stream = None
+    if format == 'raw':
+        stream = open(output, 'wb')
+
+    count = 0
+    try:
+        for tick in range(ticks + 1):
+            if tick % every == 0:
+                if stream is not None:
+                    stream.write(exporter.raw())
+                else:
+                    with open(output.format(count), 'wb') as f:
+                        f.write(exporter.png(level))
+                count += 1
+            if tick < ticks:
+                pond.tick(tick)
+    finally:
+        exporter.close()
+        if stream is not None:
+            stream.close()
+    return count
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def _main():
+    parser = argparse.ArgumentParser(description="Export pond frames.")
+    parser.add_argument('genomes', nargs='*')
+    parser.add_argument('-s','--seed',type=int,default=None)
+    parser.add_argument('--size',type=_parse_size,default=(640,480))
+    parser.add_argument('-b','--boundary',default='WRAP',
+                        choices=[b.name for b in Boundary])
+    parser.add_argument('-l','--lightning',type=int,default=0)
+    parser.add_argument('-n','--ticks',type=int,default=10000)
+    parser.add_argument('-k','--every',type=int,default=100,
+                        help="ticks between frames")
+    parser.add_argument('--overlay',default='colour',
+                        choices=sorted(OVERLAYS))
+    parser.add_argument('-f','--format',default='png',choices=['png','raw'])
+    parser.add_argument('-z','--compression',type=int,default=6)
+    parser.add_argument('-o','--output',default='pond{:06d}.png')
+    parser.add_argument('--compatible-random',action='store_true',
+                        help="random numbers as before prng.py, so old "
+                        "seeds run as they did")
+    ns = parser.parse_args()
+    prng.set_compatible(ns.compatible_random)
+
+    pond = pond_module.Pond(size=ns.size, boundary=Boundary[ns.boundary])
+    if ns.seed is not None:
+        pond._random.seed(ns.seed)
+    for filename in ns.genomes:
+        with open(filename) as f:
+            memory, instructions = algae.multiline_parse(f.read())
+        pond.spawn(memory=memory)
+    for i in range(ns.lightning):
+        pond.lightning()
+
+    count = export(pond, ns.ticks, ns.every, ns.output, overlay=ns.overlay,
+                   format=ns.format, level=ns.compression)
+    print("{} frames".format(count), file=sys.stderr)
+
+if __name__=='__main__':
+    _main()
@@ -0,0 +1,126 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import multiprocessing
+import random
+import time
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+import pond as pond_module
+from constants import *
+
+# A frame is the whole pond as RGBA bytes, one pixel per cell, rows from
+# y == 0 upwards. That's grid index order, so a cell's pixel starts at
+# index * 4.
+PIXEL_BYTES = 4
+
+def light_texture(pond):
+    # The light level visualisation, as a whole frame. Each light level
+    # gets its own random colour, seeded by the level, and there are far
+    # fewer levels than cells, so each colour is only worked out once.
+    colours = {}
+    texture = bytearray()
+    for index in range(pond.grid.area):
+        light_level = pond.light_level[index]
+        try:
+            colour = colours[light_level]
+        except KeyError:
+            r = random.Random(light_level)
+            colour = bytearray(r.randint(0,255) for i in range(PIXEL_BYTES))
+            colours[light_level] = colour
+        texture += colour
+    return texture
+
+def render_frame(pond, frame, background=None):
+    # Draw every living or inanimate cell into frame, a writable buffer of
+    # area * PIXEL_BYTES bytes, over the top of background (another
+    # frame, maybe from light_texture) or black.
+    if background is None:
+        frame[:] = bytearray(len(frame))
+    else:
+        frame[:] = background
+
+    for index, cell in pond.pond.items():
+        if cell.alive or cell.inanimate:
+            offset = index * PIXEL_BYTES
+            frame[offset:offset + PIXEL_BYTES] = bytearray(cell.colour)
+
+class SharedFrame(object):
+    # Two frame buffers in shared memory, so one process can publish frames
+    # while another reads them. The writer only ever copies into the buffer
+    # that isn't current, then flips; readers copy the current buffer out
+    # while holding the lock, so a flip can't happen halfway through.
+    def __init__(self, size):
+        self.size = size
+        self.length = size[0] * size[1] * PIXEL_BYTES
+        self.buffers = [RawArray('B', self.length) for i in range(2)]
+        self.lock = multiprocessing.Lock()
+        self.current = RawValue('i', 0)
+        # Goes up by one every flip, so readers can tell if anything's new.
+        self.sequence = RawValue('i', 0)
+
+    def publish(self, frame):
+        back = self.buffers[1 - self.current.value]
+        ctypes.memmove(back, bytes(frame), self.length)
+        with self.lock:
+            self.current.value = 1 - self.current.value
+            self.sequence.value += 1
+
+    def read(self):
+        # The current frame as bytes, and its sequence number.
+        with self.lock:
+            front = self.buffers[self.current.value]
+            return ctypes.string_at(front, self.length), self.sequence.value
+
+def simulate(shared, size, seed=None, memories=(), verbose=False,
+             light_visualise=False, frame_rate=10, boundary=Boundary.WRAP):
+    # Runs a pond flat out, forever, publishing a frame into shared every
+    # 1/frame_rate seconds. Meant to be the target of its own process.
+    pond = pond_module.Pond(size=size, boundary=boundary)
+    if seed is not None:
+        pond._random.seed(seed)
+    pond._verbose = verbose
+
+    for memory in memories:
+        pond.spawn(memory=memory)
+
+    frame = bytearray(shared.length)
+    background = None
+    if light_visualise:
+        background = light_texture(pond)
+
+    interval = 1.0 / frame_rate
+    next_frame = time.time()
+    tick = 0
+    while True:
+        now = time.time()
+        if now >= next_frame:
+            render_frame(pond, frame, background)
+            shared.publish(frame)
+            next_frame = now + interval
+
+        pond.tick(tick)
+        tick += 1
+
+def start_simulation(size, **kwargs):
+    # Start simulate in a daemon process, returning (process, shared frame).
+    shared = SharedFrame(size)
+    process = multiprocessing.Process(target=simulate, args=(shared, size),
+                                      kwargs=kwargs)
+    process.daemon = True
+    process.start()
+    return process, shared
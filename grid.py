@@ -0,0 +1,139 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+from constants import *
+
+class Grid(object):
+    # Where things are in the pond. Cells are addressed by a single integer
+    # index, y * width + x, and a step in any direction is a precomputed
+    # offset from that index. Only stepping over the edge needs any
+    # thought, and the boundary decides what happens then.
+    def __init__(self, size, boundary=Boundary.WRAP):
+        self.size = size
+        self.width, self.height = size
+        self.area = self.width * self.height
+        self.boundary = boundary
+
+        self.offsets = tuple(DY[d] * self.width + DX[d]
+                             for d in range(DIRECTIONS))
+
+    def index(self, coord):
+        x, y = coord
+        return y * self.width + x
+
+    def coord(self, index):
+        y, x = divmod(index, self.width)
+        return (x, y)
+
+    def contains(self, coord):
+        x, y = coord
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def edge_distance(self, index):
+        # How many cells are between index and the nearest edge.
+        y, x = divmod(index, self.width)
+        return min(x, y, self.width - 1 - x, self.height - 1 - y)
+
+    def edge_level(self, index):
+        # How much energy a cell at index loses each time it runs.
+        if self.boundary != Boundary.EDGESPACE:
+            return 0
+        depth = EDGE_SPACE_WIDTH - self.edge_distance(index)
+        return max(0, depth) * EDGE_DRAIN
+
+    def neighbour(self, index, direction):
+        # The index one step away in direction, or None if that's off the
+        # edge of a pond that doesn't wrap.
+        y, x = divmod(index, self.width)
+        x += DX[direction]
+        y += DY[direction]
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return index + self.offsets[direction]
+        elif self.boundary == Boundary.WRAP:
+            return (y % self.height) * self.width + (x % self.width)
+        else:
+            return None
+
+    def steps_to_edge(self, index, direction):
+        # How many steps in direction we can take before leaving the grid.
+        y, x = divmod(index, self.width)
+        dx = DX[direction]
+        dy = DY[direction]
+
+        steps = self.area
+        if dx > 0:
+            steps = min(steps, self.width - 1 - x)
+        elif dx < 0:
+            steps = min(steps, x)
+        if dy > 0:
+            steps = min(steps, self.height - 1 - y)
+        elif dy < 0:
+            steps = min(steps, y)
+        return steps
+
+    def runs(self, index, direction, n):
+        # The (up to) n cells in a straight line from index, not including
+        # index itself, as a list of (first index, count) runs. Each run
+        # stays on one line of the grid; a new one starts wherever the line
+        # wraps over the edge.
+        offset = self.offsets[direction]
+        runs = []
+        remaining = n
+        while remaining > 0:
+            index = self.neighbour(index, direction)
+            if index is None:
+                break
+            count = min(remaining, 1 + self.steps_to_edge(index, direction))
+            runs.append((index, count))
+            index += offset * (count - 1)
+            remaining -= count
+        return runs
+
+    def ray(self, index, direction, n):
+        # The same cells as runs, one index at a time. Straight runs come
+        # out as ranges, so this costs a handful of operations per edge
+        # crossed, not per cell.
+        offset = self.offsets[direction]
+        ray = []
+        for first, count in self.runs(index, direction, n):
+            if count == 1:
+                ray.append(first)
+            else:
+                ray.extend(range(first, first + offset * count, offset))
+        return ray
+
+class ColumnOrder(Sequence):
+    # Every index in the grid, column by column (x major), without making a
+    # list of them all. random.choice and random.sample pick from it just
+    # as they would from the list.
+    def __init__(self, grid):
+        self.grid = grid
+
+    def __len__(self):
+        return self.grid.area
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.grid.area
+        if not 0 <= n < self.grid.area:
+            raise IndexError(n)
+        x, y = divmod(n, self.grid.height)
+        return y * self.grid.width + x
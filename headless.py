@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import pickle
+import signal
+import sys
+import time
+
+import algae
+import analytics
+import memstore
+import pond
+import prng
+from constants import *
+
+# Run a pond with no window, for as long as we're allowed, printing a line
+# of JSON stats every so often. Send it SIGUSR1 and it checkpoints the pond
+# and carries on; SIGINT or SIGTERM and it checkpoints and stops.
+
+class Runner(object):
+    def __init__(self, pond, output=sys.stdout, stats_every=1000,
+                 checkpoint=None, tick=0):
+        self.pond = pond
+        self.output = output
+        self.stats_every = stats_every
+        self.checkpoint_path = checkpoint
+        self.tick = tick
+        self.analytics = analytics.Analytics(pond)
+
+        self._checkpoint_wanted = False
+        self._stop_wanted = False
+
+    def install_signal_handlers(self):
+        # The handlers only raise flags; the run loop acts on them between
+        # ticks, when the pond is in one piece.
+        def checkpoint(signum, frame):
+            self._checkpoint_wanted = True
+        def stop(signum, frame):
+            self._checkpoint_wanted = True
+            self._stop_wanted = True
+
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, checkpoint)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+    def run(self, ticks=None, time_limit=None):
+        start = last_time = time.time()
+        last_instructions = self.pond.instructions
+        end_tick = None
+        if ticks is not None:
+            end_tick = self.tick + ticks
+        reason = None
+
+        while True:
+            if end_tick is not None and self.tick >= end_tick:
+                reason = 'ticks'
+                break
+            if self._stop_wanted:
+                reason = 'signal'
+                break
+            if not self.pond.alive:
+                reason = 'extinct'
+                break
+
+            self.pond.tick(self.tick)
+            self.tick += 1
+
+            if self._checkpoint_wanted:
+                self.checkpoint()
+
+            if self.tick % self.stats_every == 0:
+                now = time.time()
+                instructions = self.pond.instructions
+                rate = (instructions - last_instructions) / (now - last_time
+                                                             or 1e-9)
+                self.emit(stats(self.pond, self.analytics, self.tick, now - start, rate))
+                last_time = now
+                last_instructions = instructions
+
+                # Only looked at along with the stats, so keeping to the
+                # limit costs nothing per tick.
+                if time_limit is not None and now - start >= time_limit:
+                    reason = 'time'
+                    break
+
+        now = time.time()
+        rate = (self.pond.instructions - last_instructions) / (now - last_time
+                                                               or 1e-9)
+        final = stats(self.pond, self.analytics, self.tick, now - start, rate)
+        final['finished'] = reason
+        self.emit(final)
+
+        if self._checkpoint_wanted:
+            self.checkpoint()
+        return reason
+
+    def emit(self, record):
+        self.output.write(json.dumps(record, sort_keys=True))
+        self.output.write('\n')
+        self.output.flush()
+
+    def checkpoint(self):
+        self._checkpoint_wanted = False
+        if self.checkpoint_path is None:
+            return
+        save_checkpoint(self.checkpoint_path, self.pond, self.tick)
+        self.emit({'tick': self.tick, 'checkpoint': self.checkpoint_path})
+
+def stats(pond, analytics, tick, elapsed, instructions_per_second):
+    # Only looks at what's changed since the last stats.
+    record = analytics.summary()
+    record.update({
+        'tick': tick,
+        'elapsed': round(elapsed, 3),
+        'instructions': pond.instructions,
+        'instructions_per_second': round(instructions_per_second, 1),
+    })
+    if pond.quantum is not None:
+        record['preemptions'] = pond.preemptions
+    if pond.tiles is not None:
+        record['tiles'] = len(pond.tiles)
+    if pond.store is not None:
+        record['stored_memories'] = len(pond.store)
+    if pond.latencies is not None:
+        # In microseconds, over the last LATENCY_WINDOW ticks.
+        for name, seconds in pond.latency_percentiles().items():
+            record['latency_' + name] = round(seconds * 1e6, 1)
+    return record
+
+def save_checkpoint(path, pond, tick):
+    # Written aside and renamed into place, so a checkpoint is never half
+    # there.
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        pickle.dump((tick, pond), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary, path)
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        tick, pond = pickle.load(f)
+    return pond, tick
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description="Run a pond headlessly.")
+    parser.add_argument('genomes', nargs='*',
+                        help="algae files to spawn into the pond")
+    parser.add_argument('-s','--seed',type=int,default=None)
+    parser.add_argument('--compatible-random',action='store_true',
+                        help="random numbers as before prng.py, so old "
+                        "seeds run as they did")
+    parser.add_argument('--size',type=_parse_size,default=(640,480),
+                        help="WIDTHxHEIGHT")
+    parser.add_argument('-b','--boundary',default='WRAP',
+                        choices=[b.name for b in Boundary])
+    parser.add_argument('-l','--lightning',type=int,default=0,
+                        help="random cells to spark into life at the start")
+    parser.add_argument('-n','--ticks',type=int,default=None)
+    parser.add_argument('-t','--time-limit',type=float,default=None,
+                        help="seconds of wall clock to run for")
+    parser.add_argument('--stats-every',type=int,default=1000,
+                        help="ticks between stats lines")
+    parser.add_argument('-o','--output',default=None,
+                        help="where the stats go, instead of stdout")
+    parser.add_argument('-c','--checkpoint',default=None,
+                        help="where SIGUSR1/SIGTERM checkpoints go")
+    parser.add_argument('-r','--resume',default=None,
+                        help="checkpoint to carry on from")
+    parser.add_argument('--schedule',default=None,
+                        choices=[s.name for s in Schedule],
+                        help="how cells are picked to run")
+    parser.add_argument('-q','--quantum',type=int,default=None,
+                        help="instructions a cell runs before it's put aside")
+    parser.add_argument('--tiled',action='store_true',
+                        help="only keep state for tiles with life in them")
+    parser.add_argument('--light-cutoff',type=int,default=None,
+                        help="how far a sun's light reaches")
+    parser.add_argument('--coroutines',action='store_true',
+                        help="run cells in greenlets (needs greenlet)")
+    parser.add_argument('--memory-store',default=None,metavar='PATH',
+                        help="a file to keep cell memories in, instead of "
+                        "RAM (Python 3)")
+    parser.add_argument('--latency',action='store_true',
+                        help="report tick latency percentiles")
+    return parser
+
+def _main():
+    ns = _make_parser().parse_args()
+
+    store = None
+    if ns.memory_store is not None:
+        store = memstore.MemoryStore(ns.memory_store)
+
+    prng.set_compatible(ns.compatible_random)
+    if ns.resume is not None:
+        # Cells come out of a checkpoint in RAM; only new ones are stored.
+        the_pond, tick = load_checkpoint(ns.resume)
+        the_pond.store = store
+        # A pond that draws from Python's random (from before prng.py, or
+        # run with --compatible-random) carries on that way.
+        prng.set_compatible(not isinstance(the_pond._random, prng.Stream))
+    else:
+        tick = 0
+        the_pond = pond.Pond(size=ns.size, boundary=Boundary[ns.boundary],
+                             light_cutoff=ns.light_cutoff, tiled=ns.tiled,
+                             store=store)
+        if ns.seed is not None:
+            the_pond._random.seed(ns.seed)
+
+        for filename in ns.genomes:
+            with open(filename) as f:
+                memory, instructions = algae.multiline_parse(f.read())
+            the_pond.spawn(memory=memory)
+        for i in range(ns.lightning):
+            the_pond.lightning()
+
+    if ns.schedule is not None:
+        the_pond.schedule = Schedule[ns.schedule]
+    if ns.quantum is not None:
+        the_pond.quantum = ns.quantum
+    if ns.coroutines:
+        the_pond.coroutines = True
+    if ns.latency:
+        the_pond.track_latency()
+
+    output = sys.stdout
+    if ns.output is not None:
+        output = open(ns.output, 'a')
+
+    runner = Runner(the_pond, output=output, stats_every=ns.stats_every,
+                    checkpoint=ns.checkpoint, tick=tick)
+    runner.install_signal_handlers()
+    try:
+        runner.run(ticks=ns.ticks, time_limit=ns.time_limit)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__=='__main__':
+    _main()
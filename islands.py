@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+import algae
+import pond as pond_module
+import prng
+from constants import *
+
+# Runs several ponds at once, one process each, joined up by trunkports.
+# Each pond (an island) runs for an epoch of ticks on its own, then hands
+# over everything that went through its trunkports in one batch. Once every
+# island has reported, the batches are sorted out by destination and handed
+# over to be let in at the start of the next epoch.
+#
+# Nothing depends on which process gets there first: islands are seeded by
+# their id, migrants arrive at epoch boundaries, and each island lets its
+# migrants in ordered by where they came from. So a seeded run turns out
+# the same however the processes are scheduled.
+
+def make_island(island_id, islands, size, seed=None, boundary=Boundary.WRAP,
+                trunkports=2, lightning=0, memories=()):
+    # A pond with trunkports to its neighbours either side, in a ring.
+    pond = pond_module.Pond(size=size, boundary=boundary, pond_id=island_id)
+    if seed is not None:
+        pond._random.seed(seed * 1000003 + island_id)
+    else:
+        # Otherwise every island would start out the same.
+        pond._random.seed()
+
+    if islands > 1:
+        neighbours = sorted(set([(island_id + 1) % islands,
+                                 (island_id - 1) % islands]))
+        for i in range(trunkports):
+            pond.add_trunkport(neighbours[i % len(neighbours)])
+
+    for memory in memories:
+        pond.spawn(memory=memory)
+    for i in range(lightning):
+        pond.lightning()
+    return pond
+
+def summary(pond):
+    return {
+        'island': pond.pond_id,
+        'population': len(pond.occupied),
+        'alive': len(pond.alive),
+        'souls': len(pond.ethers),
+        'instructions': pond.instructions,
+    }
+
+def run_epoch(pond, tick, ticks, arrivals):
+    # Let in arrivals, a list of (source, memory, soul, energy), then run
+    # pond for ticks. Returns the tick it got to, how many arrivals made
+    # it, and the batch of emigrants as (destination, source, memory,
+    # soul, energy).
+    landed = 0
+    for source, memory, soul, energy in arrivals:
+        if pond.immigrate(memory, soul, energy, source=source):
+            landed += 1
+
+    for i in range(ticks):
+        pond.tick(tick)
+        tick += 1
+
+    batch = [(destination, pond.pond_id, memory, soul, energy)
+             for destination, memory, soul, energy in pond.emigrants]
+    del pond.emigrants[:]
+    return tick, landed, batch
+
+def _island_process(island_id, inbox, outbox, kwargs, epoch_ticks,
+                    compatible_random):
+    prng.set_compatible(compatible_random)
+    pond = make_island(island_id, **kwargs)
+    tick = 0
+    while True:
+        arrivals = inbox.get()
+        if arrivals is None:
+            break
+        tick, landed, batch = run_epoch(pond, tick, epoch_ticks, arrivals)
+        report = summary(pond)
+        report.update({'tick': tick, 'landed': landed,
+                       'emigrated': len(batch)})
+        outbox.put((island_id, report, batch))
+
+def route(batches, islands):
+    # Sort everyone who left during an epoch into the arrivals for each
+    # island, ordered by the island they came from.
+    arrivals = [[] for i in range(islands)]
+    for island_id in range(islands):
+        for destination, source, memory, soul, energy in batches[island_id]:
+            arrivals[destination].append((source, memory, soul, energy))
+    return arrivals
+
+class Archipelago(object):
+    # The islands, and the processes running them.
+    def __init__(self, islands, epoch_ticks=1000, **kwargs):
+        self.islands = islands
+        self.epoch_ticks = epoch_ticks
+        self.outbox = multiprocessing.Queue()
+        self.inboxes = []
+        self.processes = []
+        kwargs['islands'] = islands
+        for island_id in range(islands):
+            inbox = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_island_process,
+                args=(island_id, inbox, self.outbox, kwargs, epoch_ticks,
+                      prng.compatible))
+            process.daemon = True
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        self.arrivals = [[] for i in range(islands)]
+        self.epochs = 0
+
+    def epoch(self):
+        # Run every island for one epoch, and carry the migrants across.
+        # Returns each island's report, in island order.
+        for inbox, arrivals in zip(self.inboxes, self.arrivals):
+            inbox.put(arrivals)
+
+        reports = [None] * self.islands
+        batches = [None] * self.islands
+        for i in range(self.islands):
+            island_id, report, batch = self.outbox.get()
+            reports[island_id] = report
+            batches[island_id] = batch
+
+        self.arrivals = route(batches, self.islands)
+        self.epochs += 1
+        return reports
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def _main():
+    parser = argparse.ArgumentParser(description="Run linked ponds.")
+    parser.add_argument('genomes', nargs='*',
+                        help="algae files to spawn into every island")
+    parser.add_argument('-i','--islands',type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('-s','--seed',type=int,default=None)
+    parser.add_argument('--size',type=_parse_size,default=(320,240))
+    parser.add_argument('-b','--boundary',default='WRAP',
+                        choices=[b.name for b in Boundary])
+    parser.add_argument('-p','--trunkports',type=int,default=2,
+                        help="trunkports per island")
+    parser.add_argument('-l','--lightning',type=int,default=0)
+    parser.add_argument('-e','--epoch-ticks',type=int,default=1000)
+    parser.add_argument('-n','--epochs',type=int,default=10)
+    parser.add_argument('--compatible-random',action='store_true',
+                        help="random numbers as before prng.py, so old "
+                        "seeds run as they did")
+    ns = parser.parse_args()
+    prng.set_compatible(ns.compatible_random)
+
+    memories = []
+    for filename in ns.genomes:
+        with open(filename) as f:
+            memory, instructions = algae.multiline_parse(f.read())
+        memories.append(memory)
+
+    archipelago = Archipelago(ns.islands, epoch_ticks=ns.epoch_ticks,
+                              size=ns.size, seed=ns.seed,
+                              boundary=Boundary[ns.boundary],
+                              trunkports=ns.trunkports,
+                              lightning=ns.lightning, memories=memories)
+    start = time.time()
+    try:
+        for epoch in range(ns.epochs):
+            for report in archipelago.epoch():
+                report['epoch'] = epoch
+                report['elapsed'] = round(time.time() - start, 3)
+                print(json.dumps(report, sort_keys=True))
+            sys.stdout.flush()
+    finally:
+        archipelago.close()
+
+if __name__=='__main__':
+    _main()
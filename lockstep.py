@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+
+import argparse
+import array
+import random
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import algae
+import parallel
+import prng
+from constants import *
+
+# Runs many interpreters at once, one instruction each per step, with numpy
+# doing every lane's share of a step together. Each lane does exactly what
+# parallel.run_until_event does with its job: runs up to its first
+# environment opcode, its limit, the end of its memory or its energy, and
+# stops. The scalar Interpreter is the reference; run this file to check
+# the two against each other, with each kind of RANDOM. It exits non-zero
+# if any lane differs.
+#
+# Lanes keep memories as rows of an (N, MEMORY_WORDS) array. Values are
+# worked on as uint64, which holds anything a word, literal or accumulator
+# can be, and wraps in a way that agrees with % MAX_INT. Anything that
+# won't fit (an accumulator holding a huge energy from SNIFF, say) is left
+# to the scalar interpreter.
+#
+# This only pays off for the pure Python interpreter. With _algae_core
+# built (see build_core.py), the scalar interpreter is over ten times
+# faster than this, so run_jobs goes straight to it.
+
+WORD_MASK = MAX_INT - 1
+# A step costs about the same however few lanes are still going, so once
+# there are fewer than this, the scalar interpreter finishes them off.
+MIN_LANES = 16
+
+def _opcode_table(opcodes):
+    table = [False] * 2**OPCODE_BITS
+    for opcode in opcodes:
+        table[int(opcode)] = True
+    return table
+
+if numpy is not None:
+    _COST = numpy.array([algae.OPCODE_COST.get(opcode_enum, 1)
+                         for opcode_enum in algae.OPCODE_LOOKUP],
+                        dtype=numpy.int64)
+    _STOP = numpy.array(_opcode_table(ENVIRONMENT_OPCODES), dtype=bool)
+
+class Lockstep(object):
+    def __init__(self, jobs):
+        # jobs as for parallel.run_until_event.
+        if numpy is None:
+            raise RuntimeError("the lockstep interpreter needs numpy")
+        n = len(jobs)
+        self.jobs = jobs
+        self.memory = numpy.zeros((n, MEMORY_WORDS), dtype=numpy.uint32)
+        self.ether = numpy.zeros((n, MEMORY_WORDS), dtype=numpy.uint32)
+        self.energy = numpy.zeros(n, dtype=numpy.int64)
+        self.accumulator = numpy.zeros(n, dtype=numpy.uint64)
+        self.pointer = numpy.zeros(n, dtype=numpy.int64)
+        self.direction = numpy.zeros(n, dtype=numpy.int64)
+        self.instructions = numpy.zeros(n, dtype=numpy.int64)
+        self.limit = numpy.zeros(n, dtype=numpy.int64)
+        self.running = numpy.ones(n, dtype=bool)
+        # Lanes that the scalar interpreter has to finish, and those of
+        # them that never fitted in here at all.
+        self.scalar = numpy.zeros(n, dtype=bool)
+        self.unloaded = numpy.zeros(n, dtype=bool)
+
+        for lane, (state, ether, limit) in enumerate(jobs):
+            (memory, energy, start_energy, soul, accumulator, pointer,
+             direction, instructions) = state
+            self.memory[lane] = numpy.frombuffer(algae.as_words(memory),
+                                                 dtype=numpy.uint32)
+            self.ether[lane] = numpy.frombuffer(algae.as_words(ether),
+                                                dtype=numpy.uint32)
+            if accumulator >= 2**64 or energy >= 2**62:
+                self.scalar[lane] = True
+                self.unloaded[lane] = True
+                self.running[lane] = False
+                continue
+            self.energy[lane] = energy
+            self.accumulator[lane] = accumulator
+            self.pointer[lane] = pointer
+            self.direction[lane] = direction
+            self.instructions[lane] = instructions
+            self.limit[lane] = min(limit, 2**62)
+
+    def _get(self, lanes, mode, address):
+        memory = self.memory
+        direct = memory[lanes, address].astype(numpy.uint64)
+        indirect = memory[lanes, memory[lanes, address] % MEMORY_WORDS]
+        value = numpy.where(mode == AddressMode.ACCUMULATOR,
+                            self.accumulator[lanes],
+                            address.astype(numpy.uint64))
+        value = numpy.where(mode == AddressMode.NORMAL, direct, value)
+        return numpy.where(mode == AddressMode.INDIRECT,
+                           indirect.astype(numpy.uint64), value)
+
+    def _set(self, lanes, mode, address, value):
+        to_accumulator = mode == AddressMode.ACCUMULATOR
+        self.accumulator[lanes[to_accumulator]] = value[to_accumulator]
+        # Indirect writes go to the address itself, like the interpreter.
+        to_memory = ((mode == AddressMode.NORMAL) |
+                     (mode == AddressMode.INDIRECT))
+        self.memory[lanes[to_memory], address[to_memory]] = (
+            value[to_memory] & WORD_MASK)
+
+    def step(self):
+        # Run one instruction in every running lane. Returns whether any
+        # lane is still running.
+        running = self.running
+        running &= ((self.energy > 0) & (self.pointer < MEMORY_WORDS) &
+                    (self.instructions < self.limit))
+        lanes = numpy.flatnonzero(running)
+        if not len(lanes):
+            return False
+
+        words = self.memory[lanes, self.pointer[lanes]].astype(numpy.uint64)
+        opcodes = (words >> OPCODE_SHIFT).astype(numpy.int64)
+
+        stopping = _STOP[opcodes]
+        running[lanes[stopping]] = False
+        keep = ~stopping
+        lanes, words, opcodes = lanes[keep], words[keep], opcodes[keep]
+
+        self.pointer[lanes] += 1
+        self.instructions[lanes] += 1
+        energy = self.energy[lanes] - _COST[opcodes]
+        broke = energy < 0
+        energy[broke] = 0
+        self.energy[lanes] = energy
+        running[lanes[broke]] = False
+        keep = ~broke
+        lanes, words, opcodes = lanes[keep], words[keep], opcodes[keep]
+        if not len(lanes):
+            return True
+
+        src_mode = ((words >> SRC_MODE_SHIFT) & ADDRESS_MODE_MASK)
+        src_address = ((words >> SRC_ADDR_SHIFT) & ADDRESS_MASK)
+        dest_mode = ((words >> DEST_MODE_SHIFT) & ADDRESS_MODE_MASK)
+        dest_address = ((words >> DEST_ADDR_SHIFT) & ADDRESS_MASK)
+        src_mode = src_mode.astype(numpy.int64)
+        dest_mode = dest_mode.astype(numpy.int64)
+        src_address = src_address.astype(numpy.int64)
+        dest_address = dest_address.astype(numpy.int64)
+
+        src = self._get(lanes, src_mode, src_address)
+        dest = self._get(lanes, dest_mode, dest_address)
+
+        # Everything that ends up written to dest, and the lanes doing it.
+        writing = numpy.zeros(len(lanes), dtype=bool)
+        result = numpy.zeros(len(lanes), dtype=numpy.uint64)
+
+        def opcode_is(opcode):
+            return opcodes == int(opcode)
+
+        with numpy.errstate(all='ignore'):
+            is_copy = opcode_is(Opcode.COPY)
+            result[is_copy] = src[is_copy]
+            writing |= is_copy
+
+            for opcode in BINARY_OPCODES:
+                mask = opcode_is(opcode)
+                if not mask.any():
+                    continue
+                a, b = src[mask], dest[mask]
+                if opcode == Opcode.ADD:
+                    out = a + b
+                elif opcode == Opcode.SUBTRACT:
+                    out = b - a
+                elif opcode in (Opcode.DIVIDE, Opcode.MODULO):
+                    safe = numpy.where(a == 0, 1, a).astype(numpy.uint64)
+                    if opcode == Opcode.DIVIDE:
+                        out = b // safe
+                    else:
+                        out = b % safe
+                    out = numpy.where(a == 0, WORD_MASK, out)
+                elif opcode == Opcode.BAND:
+                    out = a & b
+                elif opcode == Opcode.BOR:
+                    out = a | b
+                elif opcode == Opcode.BXOR:
+                    out = a ^ b
+                elif opcode == Opcode.LEFTSHIFT:
+                    if (b > WORD_MASK).any():
+                        # The interpreter won't have these either.
+                        huge = lanes[mask][b > WORD_MASK]
+                        self._hand_back(huge)
+                        mask &= ~numpy.isin(lanes, huge)
+                        a, b = src[mask], dest[mask]
+                    out = numpy.where(b >= WORD_BITS, 0,
+                                      b << numpy.minimum(b, WORD_BITS - 1))
+                else:
+                    out = numpy.where(b >= 64, 0,
+                                      a >> numpy.minimum(b, 63))
+                result[mask] = out & WORD_MASK
+                writing |= mask
+
+            is_zero = opcode_is(Opcode.ZERO)
+            result[is_zero] = 0
+            writing |= is_zero
+            is_binvert = opcode_is(Opcode.BINVERT)
+            result[is_binvert] = src[is_binvert] ^ WORD_MASK
+            writing |= is_binvert
+
+            is_random = opcode_is(Opcode.RANDOM)
+            if is_random.any():
+                result[is_random] = prng.random_word_array(src[is_random])
+                writing |= is_random
+
+            is_etherread = opcode_is(Opcode.ETHERREAD)
+            if is_etherread.any():
+                reading = lanes[is_etherread]
+                result[is_etherread] = self.ether[
+                    reading, src[is_etherread] % MEMORY_WORDS]
+                writing |= is_etherread
+
+        self._set(lanes[writing], dest_mode[writing], dest_address[writing],
+                  result[writing])
+
+        is_exchange = opcode_is(Opcode.EXCHANGE)
+        if is_exchange.any():
+            swapping = lanes[is_exchange]
+            self._set(swapping, dest_mode[is_exchange],
+                      dest_address[is_exchange], src[is_exchange])
+            self._set(swapping, src_mode[is_exchange],
+                      src_address[is_exchange], dest[is_exchange])
+
+        is_etherwrite = opcode_is(Opcode.ETHERWRITE)
+        if is_etherwrite.any():
+            self.ether[lanes[is_etherwrite],
+                       dest[is_etherwrite] % MEMORY_WORDS] = (
+                src[is_etherwrite] & WORD_MASK)
+
+        jumping = opcode_is(Opcode.JUMP) & (src != 0)
+        self.pointer[lanes[jumping]] = dest[jumping] % MEMORY_WORDS
+
+        skipping = ((opcode_is(Opcode.SKIP) & (src == dest)) |
+                    (opcode_is(Opcode.SKIPLESS) & (src < dest)))
+        # Skipping off the end is finishing; the next step sees that.
+        self.pointer[lanes[skipping]] += 1
+
+        facing = opcode_is(Opcode.FACE)
+        self.direction[lanes[facing]] = src[facing] % DIRECTIONS
+        return True
+
+    def _hand_back(self, lanes):
+        # Undo this step for lanes, and leave them to the interpreter.
+        self.pointer[lanes] -= 1
+        self.instructions[lanes] -= 1
+        self.energy[lanes] += _COST[int(Opcode.LEFTSHIFT)]
+        self.running[lanes] = False
+        self.scalar[lanes] = True
+
+    def run(self, min_lanes=MIN_LANES):
+        while self.step():
+            if numpy.count_nonzero(self.running) < min_lanes:
+                self.scalar |= self.running
+                self.running[:] = False
+                break
+        return self.results()
+
+    def results(self):
+        # As parallel.run_until_event would give for each job.
+        results = []
+        for lane, (state, ether, limit) in enumerate(self.jobs):
+            if self.scalar[lane]:
+                state = self._state(lane, state)
+                results.append(parallel.run_until_event(
+                    (state, self._ether(lane), limit)))
+                continue
+            results.append((self._state(lane, state), self._ether(lane)))
+        return results
+
+    def _state(self, lane, original):
+        (memory, energy, start_energy, soul, accumulator, pointer,
+         direction, instructions) = original
+        if self.unloaded[lane]:
+            return original
+        return (array.array(WORD_TYPECODE, self.memory[lane].tobytes()),
+                int(self.energy[lane]), start_energy, soul,
+                int(self.accumulator[lane]), int(self.pointer[lane]),
+                int(self.direction[lane]), int(self.instructions[lane]))
+
+    def _ether(self, lane):
+        return array.array(WORD_TYPECODE, self.ether[lane].tobytes())
+
+def run_jobs(jobs):
+    # Every job's result, as [parallel.run_until_event(job) for job in
+    # jobs] would give them.
+    if numpy is None or algae._core is not None or not jobs:
+        return [parallel.run_until_event(job) for job in jobs]
+    return Lockstep(jobs).run()
+
+def _random_job(r, genomes):
+    memory = array.array(WORD_TYPECODE, r.choice(genomes))
+    # A few differences, so lanes don't all go the same way.
+    for i in range(r.randrange(4)):
+        memory[r.randrange(MEMORY_WORDS)] = algae.random_instruction(r)
+    ether = array.array(WORD_TYPECODE,
+                        [r.getrandbits(WORD_BITS) for i in range(8)] +
+                        [0] * (MEMORY_WORDS - 8))
+    energy = r.randint(1, 5000)
+    state = (memory, energy, energy, r.getrandbits(WORD_BITS), 0, 0,
+             int(Direction.WEST), 0)
+    return state, ether, r.randint(1, 3000)
+
+def check(seed, lanes, genome_count, rounds):
+    r = random.Random(seed)
+    genomes = []
+    for i in range(genome_count):
+        genome = algae.random_memory(r)
+        # Random memory reaches the pond within a few words, which makes
+        # for a dull check, so keep the environment out of most of it.
+        for word_index, word in enumerate(genome):
+            if word >> OPCODE_SHIFT in parallel._STOP_BEFORE:
+                if r.random() < 0.95:
+                    genome[word_index] = word & ~(0xff << OPCODE_SHIFT)
+        genomes.append(genome)
+
+    failures = 0
+    scalar_time = lockstep_time = 0.0
+    for round_number in range(rounds):
+        jobs = [_random_job(r, genomes) for i in range(lanes)]
+        copies = [((array.array(WORD_TYPECODE, state[0]),) + state[1:],
+                   array.array(WORD_TYPECODE, ether), limit)
+                  for state, ether, limit in jobs]
+
+        start = time.time()
+        expected = [parallel.run_until_event(job) for job in copies]
+        scalar_time += time.time() - start
+        start = time.time()
+        got = Lockstep(jobs).run()
+        lockstep_time += time.time() - start
+
+        for lane, (want, have) in enumerate(zip(expected, got)):
+            if want != have:
+                failures += 1
+                print("round {} lane {} differs".format(round_number, lane))
+
+    print("{} lanes, {} failures, scalar {:.3f}s, lockstep {:.3f}s".format(
+        lanes * rounds, failures, scalar_time, lockstep_time))
+    return 1 if failures else 0
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description="Check the lockstep interpreter against the scalar one.")
+    parser.add_argument('-s','--seed',type=int,default=0)
+    parser.add_argument('-l','--lanes',type=int,default=256)
+    parser.add_argument('-g','--genomes',type=int,default=8)
+    parser.add_argument('-r','--rounds',type=int,default=10)
+    parser.add_argument('--compatible-random',action='store_true',
+                        help="only check RANDOM as it was before prng.py; "
+                        "otherwise it's checked both ways")
+    ns = parser.parse_args()
+
+    # The same jobs each way; RANDOM is the only thing that differs.
+    modes = [True] if ns.compatible_random else [False, True]
+    failed = 0
+    for compatible in modes:
+        prng.set_compatible(compatible)
+        print("RANDOM {}:".format(
+            "compatible" if compatible else "splitmix64"))
+        failed |= check(ns.seed, ns.lanes, ns.genomes, ns.rounds)
+    sys.exit(failed)
+
+if __name__=='__main__':
+    _main()
@@ -0,0 +1,85 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import tempfile
+
+from constants import *
+
+# Cell memories kept in a file instead of on the heap, for populations
+# bigger than there's RAM for. The file is a row of slots of MEMORY_WORDS
+# words each, mapped into memory SEGMENT_SLOTS at a time, so it can grow
+# without moving anything already handed out. A cell's memory is a
+# memoryview of its slot, which the interpreter works on where it is; the
+# OS pages it in and out as it likes.
+#
+# Words are in this machine's byte order. The file is only somewhere to
+# keep memories while the pond runs, not a way of saving them; checkpoints
+# still pickle them.
+
+SLOT_BYTES = MEMORY_WORDS * WORD_BYTES
+# 16MiB a mapping, which is a multiple of any allocation granularity.
+SEGMENT_SLOTS = 4096
+
+class MemoryStore(object):
+    def __init__(self, path=None):
+        if not hasattr(memoryview, 'cast'):
+            raise RuntimeError("the memory store needs Python 3")
+        # With no path, an anonymous file that goes when we do.
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(path, 'w+b')
+        self.path = path
+        self.segments = []
+        self._views = []
+        self.free = []
+        # Slots handed out so far, counting ones given back.
+        self.slots = 0
+
+    def __len__(self):
+        # How many slots are in use.
+        return self.slots - len(self.free)
+
+    @property
+    def mapped_bytes(self):
+        return len(self.segments) * SEGMENT_SLOTS * SLOT_BYTES
+
+    def allocate(self):
+        # Recently freed slots first, which are likelier to be paged in.
+        if self.free:
+            return self.free.pop()
+        slot = self.slots
+        if slot == len(self.segments) * SEGMENT_SLOTS:
+            self._grow()
+        self.slots += 1
+        return slot
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def view(self, slot):
+        # The slot's words, as a writable memoryview.
+        segment, n = divmod(slot, SEGMENT_SLOTS)
+        return self._views[segment][n * MEMORY_WORDS:(n + 1) * MEMORY_WORDS]
+
+    def _grow(self):
+        size = SEGMENT_SLOTS * SLOT_BYTES
+        offset = len(self.segments) * size
+        self.file.truncate(offset + size)
+        segment = mmap.mmap(self.file.fileno(), size, offset=offset)
+        self.segments.append(segment)
+        self._views.append(memoryview(segment).cast(WORD_TYPECODE))
@@ -0,0 +1,187 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import multiprocessing
+
+import algae
+import prng
+from constants import *
+
+# Runs several cells of one pond at once. Until a cell reaches one of
+# ENVIRONMENT_OPCODES it only touches its own memory and its soul's ether,
+# so a batch of cells that are well apart and have different souls can run
+# that far in worker processes without being able to tell.
+#
+# A batch tick goes:
+#
+#   1. Pick the batch, with the pond's random, from cells at least
+#      BATCH_SPACING apart with souls of their own.
+#   2. Run each one in a worker up to its first environment opcode.
+#   3. Write back every cell's memory, energy and ether, and leave its
+#      interpreter suspended where it stopped (see Pond.run_cell).
+#   4. Run each cell in batch order from there, in this process, as usual.
+#
+# Workers only ever see their own cell, and everything after them happens
+# in order, so a seeded pond goes the same way however many processes
+# there are, including none, so long as the batch size is the same.
+
+# How far apart (in steps) batched cells are, so nothing one of them does
+# to its neighbours touches another's neighbours.
+BATCH_SPACING = 3
+
+_STOP_BEFORE = frozenset(int(opcode) for opcode in ENVIRONMENT_OPCODES)
+
+def run_until_event(job):
+    # In a worker: run an interpreter's state up to its first environment
+    # opcode, or its limit. Returns its new state and ether.
+    state, ether, limit = job
+    interpreter = algae.Interpreter(ether=ether)
+    interpreter.set_state(state)
+    interpreter.limit = limit
+    interpreter.stop_before = _STOP_BEFORE
+    try:
+        interpreter()
+    except algae.AlgaeEnder:
+        pass
+    return interpreter.get_state(), interpreter.ether
+
+def _nearby(grid, index, steps):
+    # Every index within steps of index.
+    nearby = set([index])
+    edge = [index]
+    for step in range(steps):
+        next_edge = []
+        for here in edge:
+            for direction in range(DIRECTIONS):
+                there = grid.neighbour(here, direction)
+                if there is not None and there not in nearby:
+                    nearby.add(there)
+                    next_edge.append(there)
+        edge = next_edge
+    return nearby
+
+class ParallelTicker(object):
+    def __init__(self, pond, processes=None, batch_size=None,
+                 lockstep=False):
+        # processes=0 does the worker's share in this process, which gives
+        # the same results, slower. lockstep does it in this process too,
+        # but with every cell of the batch at once (see lockstep.py), which
+        # pays off for big batches, unless _algae_core is built.
+        self.pond = pond
+        self.run_jobs = None
+        if lockstep:
+            import lockstep as lockstep_module
+            self.run_jobs = lockstep_module.run_jobs
+            processes = 0
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if batch_size is None:
+            batch_size = PARALLEL_BATCH
+        self.batch_size = batch_size
+        self.pool = None
+        if processes:
+            # Workers run RANDOM, so they need the same prng mode.
+            self.pool = multiprocessing.Pool(
+                processes, initializer=prng.set_compatible,
+                initargs=(prng.compatible,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def choose_batch(self):
+        pond = self.pond
+        alive = pond._alive_sequence()
+        count = min(len(alive), self.batch_size * 4)
+        batch = []
+        souls = set()
+        blocked = set()
+        for index in pond._random.sample(alive, count):
+            cell = pond.pond[index]
+            if cell.soul is None or cell.soul in souls or index in blocked:
+                continue
+            batch.append(index)
+            souls.add(cell.soul)
+            blocked.update(_nearby(pond.grid, index, BATCH_SPACING - 1))
+            if len(batch) == self.batch_size:
+                break
+        return batch
+
+    def _job(self, index, limit):
+        pond = self.pond
+        cell = pond.pond[index]
+        base = pond.ethers.base(cell.soul)
+        suspended = pond._suspended.get(index)
+        if (suspended is not None and suspended[0] is cell and
+                suspended[1].cell_soul == cell.soul):
+            interpreter = suspended[1]
+            interpreter.energy = cell.energy
+        else:
+            interpreter = algae.Interpreter(cell)
+        state = list(interpreter.get_state())
+        # The memory may go off to a worker, so it can't be a slot in a
+        # memory store.
+        if isinstance(state[0], memoryview):
+            state[0] = algae.as_words(state[0], copy=True)
+        # Only count what the worker runs.
+        state[-1] = 0
+        ether = pond.ethers.words[base:base + MEMORY_WORDS]
+        return tuple(state), ether, limit
+
+    def tick(self, N):
+        # One batch tick, which runs a whole batch of cells.
+        pond = self.pond
+        pond.ticks = N
+        batch = self.choose_batch()
+        limit = pond.quantum or PARALLEL_QUANTUM
+
+        jobs = [self._job(index, limit) for index in batch]
+        if self.run_jobs is not None:
+            results = self.run_jobs(jobs)
+        elif self.pool is not None:
+            results = self.pool.map(run_until_event, jobs)
+        else:
+            results = [run_until_event(job) for job in jobs]
+
+        ether = pond.ethers.words
+        for index, (state, cell_ether) in zip(batch, results):
+            cell = pond.pond[index]
+            base = pond.ethers.base(cell.soul)
+            interpreter = algae.Interpreter(cell, ether=ether,
+                                            ether_base=base)
+            interpreter.set_state(state)
+            pond.instructions += interpreter.instructions
+            interpreter.write_cell(cell)
+            # For a StoredCell that copied the worker's memory into its
+            # slot; the interpreter goes back to working on the slot, so
+            # whatever's written there while it waits isn't lost.
+            interpreter.memory = cell.memory
+            ether[base:base + MEMORY_WORDS] = cell_ether
+            previous = pond._suspended.get(index)
+            if previous is not None:
+                previous[1].close()
+            pond._suspended[index] = (cell, interpreter)
+            pond._touch(index)
+
+        for index in batch:
+            pond.run_cell(index, quantum=pond.quantum)
+
+        pond.ethers.collect()
+        if pond.sweep_budget:
+            pond.sweep(pond.sweep_budget)
+        return len(batch)
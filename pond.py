@@ -20,85 +20,494 @@ import random
 import struct
 import collections
 import os.path
-
-import bitstring
+import array
+import bisect
+import timeit
 
 import algae
+import prng
+from grid import Grid, ColumnOrder
+from spatial import OccupancyIndex
+from ether import EtherPool
+from environment import Environment
+from tiles import Tiles, TiledEnvironment
 from constants import *
 
+_EMPTY_MEMORY_BYTES = b'\0' * (MEMORY_WORDS * WORD_BYTES)
+
 class Pond(object):
-    def __init__(self, size=(640,480)):
+    def __init__(self, size=(640,480), boundary=Boundary.WRAP, pond_id=0,
+                 light_cutoff=None, tiled=False, store=None):
         self.size = size
-        self._random = random.Random(3)
+        self.pond_id = pond_id
+        # Every step from one cell to the next goes through the grid, so
+        # nothing ever ends up outside the pond.
+        self.grid = Grid(size, boundary=boundary)
+        self._random = prng.pond_random(3)
         self._verbose = False
 
-        self.alive = set()
-        self.ethers = collections.defaultdict(dict)
-
-        # Lazy pond only initialised cell when we need it.
-        self.pond = collections.defaultdict(Cell)
-
-        self.normal_space = []
-        for i in range(size[0]):
-            for j in range(size[1]):
-                self.normal_space.append((i,j))
-
-        self.light_level = collections.defaultdict(int)
+        self.alive = AliveSet()
+        # Total instructions run by every interpreter, ever.
+        self.instructions = 0
+        # Every cell with a soul, for LADAR to look along.
+        self.occupied = OccupancyIndex(self.grid)
+        self.ethers = EtherPool()
+        # Ways out to other ponds, as {index: the pond id they lead to}.
+        # Whatever MOVEs through one waits in emigrants until whoever is
+        # running the ponds carries it across.
+        self.trunkports = {}
+        self.trunkport_index = OccupancyIndex(self.grid)
+        self.emigrants = []
+        # A tiled pond only keeps per-index state for tiles with life in
+        # them (see tiles.py), for worlds too big to keep it everywhere.
+        self.tiles = None
+        if tiled:
+            self.tiles = Tiles(self.grid)
+        # The interned id of the soul at each index, 0 being no soul. Ids
+        # are handed out by the EtherPool.
+        if tiled:
+            self.soul_ids = self.tiles.soul_ids
+        else:
+            self.soul_ids = array.array('i', [0]) * self.grid.area
+
+        # Lazy pond only initialises a cell when something writes to it.
+        # Cells are keyed by their grid index.
+        self.pond = LazyPond()
+        # With a memstore.MemoryStore, cells keep their memories in it
+        # rather than on the heap, as StoredCells.
+        self.store = store
+
+        # Column by column, so seeded ponds pick the same places they
+        # always have.
+        self.normal_space = ColumnOrder(self.grid)
+
+        # Light, and everything else a cell can smell about where it is,
+        # by index. With a light_cutoff, suns only light that far around.
+        if tiled:
+            self.environment = TiledEnvironment(self.tiles,
+                                                cutoff=light_cutoff)
+        else:
+            self.environment = Environment(self.grid, cutoff=light_cutoff)
+        self.light_level = self.environment.light
         self._generate_suns()
 
-    def _generate_suns(self):
-        sun_coords = self._random.sample(self.normal_space, NUMBER_OF_SUNS)
-
-        for sun_coord in sun_coords:
-            self.pond[sun_coord] = SunCell()
-            for coord in self.normal_space:
-                distance_squared = (coord[0] - sun_coord[0])**2
-                distance_squared += (coord[1] - sun_coord[1])**2
-
-                self.light_level[coord] += LIGHT_FADE(distance_squared)
-
-        for key in self.light_level:
-            self.light_level[key] = int(self.light_level[key])
+        # Dead, blank cells are put back to being EMPTY_CELL a few at a
+        # time, so the pond only holds on to memory for what's actually
+        # there.
+        self.sweep_budget = SWEEP_BUDGET
+        self.sweep_stats = {'passes': 0, 'examined': 0, 'reclaimed': 0,
+                            'reclaimed_bytes': 0}
+        self._sweep_queue = []
+
+        # Sets handed out by watch, that changed indexes are added to.
+        self._watchers = []
+
+        # How cells get picked to run, and how many instructions one gets
+        # before it's put aside, to carry on from where it was the next
+        # time it's picked. None lets cells run until they stop.
+        self.schedule = Schedule.UNIFORM
+        self.quantum = None
+        self.preemptions = 0
+        self._suspended = {}
+        # For the weighted schedules: which schedule alive's keys are for,
+        # and a watch set of the indexes whose keys may have changed since.
+        self._keyed_by = None
+        self._key_changes = None
+        # Run cells as algae.CoroutineInterpreters, which need greenlet.
+        self.coroutines = False
+        # The tick each index's soul arrived, for Schedule.AGE.
+        self.ticks = 0
+        if tiled:
+            self.born = self.tiles.born
+        else:
+            self.born = array.array('l', [0]) * self.grid.area
+        # How long recent ticks took, once track_latency is called.
+        self.latencies = None
 
+    def _generate_suns(self):
+        sun_indexes = self._random.sample(self.normal_space, NUMBER_OF_SUNS)
+
+        for sun_index in sun_indexes:
+            self.pond[sun_index] = SunCell()
+            self.environment.add_sun(sun_index)
+
+    def add_sun(self, coord=None, brightness=SUN_MAX_BRIGHTNESS):
+        # Light up another part of the pond. Whatever was there is burnt
+        # away, unless it's inanimate.
+        index = self._choose_index(coord)
+        while coord is None and self.pond[index].inanimate:
+            index = self._choose_index(coord)
+        if self.pond[index].inanimate:
+            raise ValueError("{} is already taken".format(coord))
+
+        self._place(index, SunCell())
+        self.alive.discard(index)
+        self.environment.add_sun(index, brightness)
+        return index
+
+    def _sun_index(self, coord):
+        if not self.grid.contains(coord):
+            raise ValueError("{} is outside the pond".format(coord))
+        index = self.grid.index(coord)
+        if index not in self.environment.suns:
+            raise ValueError("there's no sun at {}".format(coord))
+        return index
+
+    def remove_sun(self, coord):
+        index = self._sun_index(coord)
+        self.environment.remove_sun(index)
+        del self.pond[index]
+        self._touch(index)
+
+    def move_sun(self, coord, new_coord):
+        # Burns away whatever's in the way, like add_sun.
+        index = self._sun_index(coord)
+        new_index = self._choose_index(new_coord)
+        if new_index == index:
+            return
+        if self.pond[new_index].inanimate:
+            raise ValueError("{} is already taken".format(new_coord))
+
+        self.environment.move_sun(index, new_index)
+        del self.pond[index]
+        self._touch(index)
+        self._place(new_index, SunCell())
+        self.alive.discard(new_index)
+
+    def set_sun_brightness(self, coord, brightness):
+        self.environment.set_brightness(self._sun_index(coord), brightness)
+
+    def watch(self):
+        # A set that every index that changes from now on (its soul, energy
+        # or memory) is added to. Whoever asked for it empties it when they
+        # like, and gives it back to unwatch when they're done.
+        changed = set()
+        self._watchers.append(changed)
+        return changed
+
+    def unwatch(self, changed):
+        # By identity: two watchers with nothing in them yet are equal.
+        for position, watcher in enumerate(self._watchers):
+            if watcher is changed:
+                del self._watchers[position]
+                return
+        raise ValueError("not watching with that set")
+
+    def __getstate__(self):
+        # Whoever is watching doesn't come along into a pickle.
+        state = self.__dict__.copy()
+        state['_watchers'] = []
+        # Nor do cells that are halfway through running; they start again
+        # from the top.
+        state['_suspended'] = {}
+        # Nor does the memory store; the cells in it pickle as plain Cells.
+        state['store'] = None
+        # Nor do alive's keys, which are worked out again when needed.
+        state['_keyed_by'] = None
+        state['_key_changes'] = None
+        return state
+
+    def _touch(self, index):
+        for changed in self._watchers:
+            changed.add(index)
 
     def tick(self, N):
-        self.run_alive_cell()
+        self.ticks = N
+        if self.latencies is None:
+            self.run_alive_cell()
+        else:
+            start = timeit.default_timer()
+            self.run_alive_cell()
+            self.latencies.append(timeit.default_timer() - start)
+        self.ethers.collect()
+        if self.sweep_budget:
+            self.sweep(self.sweep_budget)
+
+    def sweep(self, budget):
+        # Look at up to budget cells, and forget any that are no different
+        # from EMPTY_CELL: no soul, no energy, nothing in their memory, and
+        # no interpreter put aside to carry on with.
+        # A dead cell that's still carrying code isn't forgotten; something
+        # may yet TEACH or NUDGE it back to life. Sweeping never changes
+        # what happens in the pond, only what it holds on to. The cells are
+        # visited from a snapshot of the pond, taken once per pass.
+        pond = self.pond
+        queue = self._sweep_queue
+        stats = self.sweep_stats
+        refilled = False
+
+        for i in range(budget):
+            if not queue:
+                if refilled:
+                    # Been round the whole pond already.
+                    break
+                queue.extend(pond)
+                refilled = True
+                stats['passes'] += 1
+
+            index = queue.pop()
+            cell = pond.get(index)
+            stats['examined'] += 1
+            if (cell is None or cell.inanimate or cell.soul is not None
+                    or cell.energy or cell.debug or index in self._suspended
+                    or cell.memory.tobytes() != _EMPTY_MEMORY_BYTES):
+                continue
+
+            del pond[index]
+            if isinstance(cell, StoredCell):
+                cell.release()
+            # It's left in alive, if it's there; run_cell takes it out when
+            # it's next picked, just as it would have.
+            self._touch(index)
+            stats['reclaimed'] += 1
+            stats['reclaimed_bytes'] += MEMORY_WORDS * WORD_BYTES
 
     def run_alive_cell(self):
         if self.alive:
-            coord = self._random.choice(list(self.alive))
-            self.run_cell(coord)
+            if self.schedule == Schedule.UNIFORM:
+                index = self._random.choice(self._alive_sequence())
+            else:
+                index = self._weighted_choice()
+            self.run_cell(index, quantum=self.quantum)
+
+    def _alive_sequence(self):
+        # The living indexes, to pick from. A pond drawing from Python's
+        # random (prng's compatible mode, or a checkpoint from before it)
+        # picks from them in the set's order, as it always has; otherwise
+        # there's no need to copy them out every tick.
+        if isinstance(self._random, prng.Stream):
+            return self.alive.indexes
+        return list(self.alive)
+
+    def _schedule_key(self, index):
+        # What alive keeps for index, under the weighted schedules.
+        if self.schedule == Schedule.ENERGY:
+            # Plus one, so the penniless still get a look in.
+            return self.pond[index].energy + 1
+        return self.born[index]
+
+    def _weighted_choice(self):
+        # Each living index is picked in proportion to its energy plus one,
+        # or to how many ticks its soul has been there plus one. A pond
+        # drawing from Python's random does it the way it always has; any
+        # other keeps the weights in alive, and only updates the ones that
+        # have changed, so a pick doesn't cost the whole population.
+        if not isinstance(self._random, prng.Stream):
+            return self._listed_weighted_choice()
+
+        alive = self.alive
+        if (alive.keys is None or self._keyed_by != self.schedule or
+                self._key_changes is None):
+            if self._key_changes is None:
+                self._key_changes = self.watch()
+            self._key_changes.clear()
+            alive.key_by([self._schedule_key(index)
+                          for index in alive.indexes])
+            self._keyed_by = self.schedule
+        else:
+            changes = self._key_changes
+            changes.update(alive.unkeyed)
+            alive.unkeyed.clear()
+            for index in changes:
+                if index in alive:
+                    alive.set_key(index, self._schedule_key(index))
+            changes.clear()
+
+        if self.schedule == Schedule.ENERGY:
+            weigh = None
+        else:
+            # A soul's age is now - born, so a run of span indexes whose
+            # born add up to total weighs this much.
+            now = self.ticks
+            weigh = lambda span, total: span * (now + 1) - total
+        keys = alive.keys
+        position = keys.find(self._random.random() * keys.weight(weigh),
+                             weigh)
+        return alive.indexes[position]
+
+    def _listed_weighted_choice(self):
+        indexes = list(self.alive)
+        totals = []
+        total = 0
+        if self.schedule == Schedule.ENERGY:
+            pond = self.pond
+            for index in indexes:
+                # Plus one, so the penniless still get a look in.
+                total += pond[index].energy + 1
+                totals.append(total)
+        else:
+            born = self.born
+            now = self.ticks
+            for index in indexes:
+                total += max(0, now - born[index]) + 1
+                totals.append(total)
+        chosen = bisect.bisect_right(totals, self._random.random() * total)
+        return indexes[min(chosen, len(indexes) - 1)]
+
+    def track_latency(self, window=LATENCY_WINDOW):
+        self.latencies = collections.deque(maxlen=window)
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        # {'p50': seconds, ..., 'max': seconds} over the recent ticks.
+        if not self.latencies:
+            return {}
+        latencies = sorted(self.latencies)
+        result = {'max': latencies[-1]}
+        for percentile in percentiles:
+            rank = int(math.ceil(percentile / 100.0 * len(latencies))) - 1
+            result['p{}'.format(percentile)] = latencies[max(0, rank)]
+        return result
+
+    def _choose_index(self, coord):
+        if coord is None:
+            return self._random.choice(self.normal_space)
+        elif not self.grid.contains(coord):
+            raise ValueError("{} is outside the pond".format(coord))
+        else:
+            return self.grid.index(coord)
 
     def lightning(self, coord=None):
         # The spark of life happens. Also, it grants souls.
-        if coord is None:
-            coord = self._random.choice(self.normal_space)
-        self.pond[coord] = cell = Cell(energy=START_ENERGY,
-                                       randomised=self._random)
+        index = self._choose_index(coord)
+        cell = self._new_cell(energy=START_ENERGY, randomised=self._random)
+        self._place(index, cell)
 
-        self.alive.add(coord)
-        self.run_cell(coord)
+        self.alive.add(index)
+        self.run_cell(index)
 
     def spawn(self, memory, soul=None, coord=None):
-        if coord is None:
-            coord = self._random.choice(self.normal_space)
+        index = self._choose_index(coord)
 
         if soul is None:
             soul = algae.random_soul(random=self._random)
+        soul = algae.as_soul(soul)
+
+        cell = self._new_cell(energy=START_ENERGY, soul=soul, memory=memory)
+        self._place(index, cell)
+        self.alive.add(index)
+        self.run_cell(index)
+
+    def add_trunkport(self, destination, coord=None):
+        # Open a trunkport to the pond with id destination.
+        index = self._choose_index(coord)
+        while coord is None and self.pond[index].inanimate:
+            index = self._choose_index(coord)
+        if self.pond[index].inanimate:
+            raise ValueError("{} is already taken".format(coord))
+
+        self._place(index, TrunkportCell())
+        self.alive.discard(index)
+        self.trunkports[index] = destination
+        self.trunkport_index.add(index)
+        return index
+
+    def immigrate(self, memory, soul, energy, source=None):
+        # An organism arriving through a trunkport; through one leading
+        # back to source if there is one. It lands on a free cell next to
+        # the trunkport, and is lost if there isn't one. Returns whether
+        # it made it.
+        if not self.trunkports:
+            return False
+        ports = sorted(index for index, destination
+                       in self.trunkports.items() if destination == source)
+        port = self._random.choice(ports or sorted(self.trunkports))
+
+        first = self._random.randrange(DIRECTIONS)
+        for turn in range(DIRECTIONS):
+            index = self.grid.neighbour(port, (first + turn) % DIRECTIONS)
+            if index is None:
+                continue
+            other = self.pond[index]
+            if other.inanimate or other.alive:
+                continue
+
+            cell = self._new_cell(energy=energy, soul=soul, memory=memory)
+            self._place(index, cell)
+            self.alive.add(index)
+            return True
+        return False
+
+    def _place(self, index, cell):
+        # Put a brand new cell at index, replacing whatever was there.
+        old = self.pond[index]
+        self._set_soul(index, old, None)
+        self.pond[index] = cell
+        if isinstance(old, StoredCell):
+            old.release()
+        soul, cell.soul = cell.soul, None
+        self._set_soul(index, cell, soul)
+        self._touch(index)
+
+    def _set_soul(self, index, cell, soul):
+        # Souls only change through here, so that the occupancy index
+        # sees every birth and death, and ethers know who holds them.
+        old_soul = cell.soul
+        if old_soul == soul:
+            return
 
-        cell = Cell(energy=START_ENERGY, soul=soul, memory=memory)
-        self.pond[coord] = cell
-        self.alive.add(coord)
-        self.run_cell(coord)
+        if old_soul is None:
+            self.occupied.add(index)
+        else:
+            self.ethers.release(old_soul)
 
-    def run_cell(self, coord):
-        cell = self.pond[coord]
+        if soul is None:
+            self.occupied.discard(index)
+        else:
+            self.ethers.retain(soul)
+        cell.soul = soul
+        self.soul_ids[index] = self.ethers.ids[soul]
+        self.born[index] = self.ticks
+        self._touch(index)
+
+    def _materialise(self, index):
+        # Swap in a real cell wherever EMPTY_CELL was standing in.
+        assert 0 <= index < self.grid.area
+        cell = self.pond.get(index)
+        if cell is None:
+            cell = self.pond[index] = self._new_cell()
+            self._touch(index)
+        return cell
+
+    def _new_cell(self, **kwargs):
+        if self.store is None:
+            return Cell(**kwargs)
+        return StoredCell(self.store, **kwargs)
+
+    def _interpreter(self, cell, ether, ether_base):
+        if self.coroutines:
+            return algae.CoroutineInterpreter(cell, ether=ether,
+                                              ether_base=ether_base)
+        return algae.Interpreter(cell, ether=ether, ether_base=ether_base)
+
+    def run_cell(self, index, quantum=None):
+        cell = self.pond[index]
+        suspended = self._suspended.pop(index, None)
         if cell.soul is None and cell.energy == 0:
-            self.alive.discard(coord)
+            self.alive.discard(index)
+            if suspended is not None:
+                suspended[1].close()
             return
 
-        ether = self.ethers[cell.soul]
-        interpreter = algae.Interpreter(cell, ether=ether)
+        edge_level = self.grid.edge_level(index)
+        if edge_level:
+            cell.energy = max(0, cell.energy - edge_level)
+
+        ether = self.ethers.words
+        ether_base = self.ethers.base(cell.soul)
+        if (suspended is not None and suspended[0] is cell and
+                suspended[1].cell_soul == cell.soul):
+            # Carry on from where it was preempted. Its memory is the
+            # cell's, so anything written to it since is already there, but
+            # its energy may have been taken or given since.
+            interpreter = suspended[1]
+            interpreter.energy = cell.energy
+            interpreter.instructions = 0
+        else:
+            if suspended is not None:
+                suspended[1].close()
+            interpreter = self._interpreter(cell, ether, ether_base)
+        if quantum is not None:
+            interpreter.limit = quantum
         while True:
             try:
                 try:
@@ -108,25 +517,37 @@ class Pond(object):
                     interpreter.write_cell(cell)
                     raise
             except algae.SniffEnder as sniff:
-                answer = 0
-
-                if sniff.type == Scent.LIGHT_LEVEL:
-                    answer = self.light_level[cell]
+                if sniff.type == Scent.CURRENT_POND_ID:
+                    answer = self.pond_id
+                else:
+                    answer = self.environment.scent(sniff.type, index)
 
                 sniff.callback(answer % MAX_INT)
 
             except algae.LadarEnder as ladar:
-                def key(cell):
-                    return cell.soul is not None
-                hit = self._run_until(coord, interpreter.direction, key)
-                if hit is None:
-                    result = LadarAnswer.NOTHING
-                else:
-                    other = self.pond[hit]
-                    if cell.soul == other.soul:
+                direction = interpreter.direction
+                hit = self.occupied.first(index, direction, LADAR_RANGE)
+                port = None
+                if self.trunkports:
+                    port = self.trunkport_index.first(index, direction,
+                                                      LADAR_RANGE)
+                if port is not None and hit is not None:
+                    beam = self.grid.ray(index, direction, LADAR_RANGE)
+                    if beam.index(hit) < beam.index(port):
+                        port = None
+
+                if port is not None:
+                    result = LadarAnswer.TRUNKPORT
+                elif hit is not None:
+                    if self.soul_ids[hit] == self.soul_ids[index]:
                         result = LadarAnswer.SOULMATE
                     else:
                         result = LadarAnswer.HEATHEN
+                elif (self.grid.boundary != Boundary.WRAP and
+                      self.grid.steps_to_edge(index, direction) < LADAR_RANGE):
+                    result = LadarAnswer.EDGELINE
+                else:
+                    result = LadarAnswer.NOTHING
 
                 ladar.callback(result)
                 continue
@@ -136,27 +557,35 @@ class Pond(object):
                 break
             except algae.FinishedBookEnder:
                 break
+            except algae.PreemptEnder:
+                self._suspended[index] = (cell, interpreter)
+                self.preemptions += 1
+                break
             except algae.NudgeEnder as nudge:
                 nudge_energy = cell.energy
                 nudge_soul = cell.soul
 
                 cell.energy = 0
-                cell.soul = None
+                self._set_soul(index, cell, None)
 
-                other_coord = apply_direction(coord, interpreter.direction)
-                other = self.pond[other_coord]
+                other_index = self.grid.neighbour(index, interpreter.direction)
+                other = self.pond[other_index]
 
-                can_access = cell.can_access(other)
+                # Nudging over the edge of the pond, or into a sun or a
+                # trunkport, throws it all away.
+                can_access = (other_index is not None and
+                              not other.inanimate and
+                              cell.can_access(other))
                 if can_access and nudge_energy:
+                    other = self._materialise(other_index)
                     other.energy += nudge_energy
-                    other.soul = nudge_soul
-
-                    self.alive.add(other_coord)
+                    self._set_soul(other_index, other, nudge_soul)
 
-                    bit_index = nudge.word_index * WORD_BITS
-                    value = bitstring.Bits(uint=nudge.value, length=WORD_BITS)
+                    self.alive.add(other_index)
 
-                    other.memory.overwrite(value, bit_index)
+                    other.write_memory(nudge.word_index,
+                                       [nudge.value % MAX_INT])
+                    self._touch(other_index)
 
                 break
 
@@ -164,41 +593,46 @@ class Pond(object):
                 word_index = teach.word_index
                 value = teach.value
 
-                other_coord = apply_direction(coord, interpreter.direction)
-                other = self.pond[other_coord]
+                other_index = self.grid.neighbour(index, interpreter.direction)
+                other = self.pond[other_index]
 
-                if cell.can_access(other):
-                    bit_index = word_index * WORD_BITS
-                    bit_value = bitstring.Bits(uint=value, length=WORD_BITS)
-                    other.memory.overwrite(bit_value, bit_index)
+                if (other_index is not None and not other.inanimate and
+                        cell.can_access(other)):
+                    other = self._materialise(other_index)
+                    other.write_memory(word_index, [value % MAX_INT])
+                    self._touch(other_index)
                 # Drop straight back in.
                 continue
 
             except algae.BaskEnder:
-                cell.energy += self.light_level[coord]
+                cell.energy += self.light_level[index]
                 break
             except algae.ProcureEnder as procure:
-                other_coord = apply_direction(coord, interpreter.direction)
-                other = self.pond[other_coord]
+                other_index = self.grid.neighbour(index, interpreter.direction)
+                other = self.pond[other_index]
                 if cell.can_access(other) and other.energy:
                     amount = min(other.energy, procure.amount)
                     cell.energy += amount
                     other.energy -= amount
+                    self._touch(other_index)
 
                     if other.energy == 0:
-                        other.soul = None
-                        self.alive.discard(other_coord)
+                        self._set_soul(other_index, other, None)
+                        self.alive.discard(other_index)
 
                 break
 
             except algae.BestowEnder as bestow:
-                other_coord = apply_direction(coord, interpreter.direction)
-                other = self.pond[other_coord]
+                other_index = self.grid.neighbour(index, interpreter.direction)
+                other = self.pond[other_index]
                 cell.energy -= bestow.amount
-                if cell.can_access(other):
+                if (other_index is not None and not other.inanimate and
+                        cell.can_access(other)):
+                    other = self._materialise(other_index)
                     other.energy += bestow.amount
-                    other.soul = cell.soul
-                    self.alive.add(other_coord)
+                    self._set_soul(other_index, other, cell.soul)
+                    self._touch(other_index)
+                    self.alive.add(other_index)
                 continue
 
             except algae.StopEnder:
@@ -215,26 +649,34 @@ class Pond(object):
 
                 interpreter.write_cell(cell)
 
-                mobile_code = cell.memory[:WORD_BITS * cutoff_point]
+                mobile_code = array.array(WORD_TYPECODE,
+                                          cell.memory[:cutoff_point])
                 mobile_soul = cell.soul
                 mobile_energy = cell.energy
 
                 cell.energy = 0
-                cell.soul = None
-                self.alive.remove(coord)
+                self._set_soul(index, cell, None)
+                self.alive.remove(index)
 
                 # Work out where we end up.
-                current_coord = coord
-                future_coord = None
+                current_index = index
+                future_index = None
                 remaining_fuel = fuel
 
                 while True:
-                    future_coord = apply_direction(current_coord, direction)
-                    future_cell = self.pond[future_coord]
+                    future_index = self.grid.neighbour(current_index, direction)
+                    if future_index is None:
+                        # Can't move off the edge of the pond.
+                        break
+                    future_cell = self.pond[future_index]
                     # Then check to see if we have enough fuel, and whether
                     # we can end up there.
                     if not cell.can_access(future_cell):
                         break
+                    # Suns are in the way; trunkports are a way out.
+                    if (future_cell.inanimate and
+                            future_index not in self.trunkports):
+                        break
                     cost = cutoff_point
                     if direction in DIAGONAL_DIRECTIONS:
                         cost = math.ceil(cost * ROOT_TWO)
@@ -245,82 +687,102 @@ class Pond(object):
 
                     # otherwise we keep moving
                     remaining_fuel = int(remaining_fuel - cost)
-                    current_coord = future_coord
+                    current_index = future_index
+                    if current_index in self.trunkports:
+                        break
 
-                if remaining_fuel:
-                    cell_in_front = self.pond[future_coord]
+                if current_index in self.trunkports:
+                    # Out through the trunkport, with whatever fuel is
+                    # left over, to be carried to another pond.
+                    self.emigrants.append((self.trunkports[current_index],
+                                           mobile_code, mobile_soul,
+                                           mobile_energy + remaining_fuel))
+                    break
+
+                # Whatever it stopped short of gets the fuel left over,
+                # unless that's a sun.
+                if (remaining_fuel and future_index is not None and
+                        not self.pond[future_index].inanimate):
+                    cell_in_front = self._materialise(future_index)
                     cell_in_front.energy += remaining_fuel
+                    self._touch(future_index)
                     if cell_in_front.soul is None:
-                        cell_in_front.soul = mobile_soul
+                        self._set_soul(future_index, cell_in_front,
+                                       mobile_soul)
 
-                new_cell = self.pond[current_coord]
-                new_cell.soul = mobile_soul
+                new_cell = self._materialise(current_index)
+                self._set_soul(current_index, new_cell, mobile_soul)
                 new_cell.energy = mobile_energy
-                new_cell.memory.overwrite(mobile_code, 0)
-                self.alive.add(current_coord)
+                new_cell.write_memory(0, mobile_code)
+                self._touch(current_index)
+                self.alive.add(current_index)
 
                 break
             except algae.HandoffEnder:
                 # Write back the changes.
+                self._touch(index)
                 if cell.energy == 0:
-                    cell.soul = None
-                    self.alive.remove(coord)
+                    self._set_soul(index, cell, None)
+                    self.alive.remove(index)
 
                 # Then load the new cell, and a new interpreter.
-                new_coord = apply_direction(coord, interpreter.direction)
-                assert new_coord != coord
-                coord = new_coord
-                cell = self.pond[coord]
-                interpreter = algae.Interpreter(cell, ether=ether)
+                new_index = self.grid.neighbour(index, interpreter.direction)
+                if new_index is None:
+                    # Handing off over the edge goes nowhere.
+                    break
+                assert new_index != index
+                index = new_index
+                cell = self.pond[index]
+                if cell is EMPTY_CELL:
+                    # Nothing there to run, or to write back to.
+                    break
+                self.instructions += interpreter.instructions
+                limit = interpreter.limit - interpreter.instructions
+                interpreter.close()
+                interpreter = self._interpreter(cell, ether, ether_base)
+                interpreter.limit = limit
                 continue
 
         # ENDWHILE
+        self.instructions += interpreter.instructions
+        if self._suspended.get(index, (None, None))[1] is not interpreter:
+            interpreter.close()
+        self._touch(index)
         if not cell.energy:
-            cell.soul = None
+            self._set_soul(index, cell, None)
         # phew.
 
-    def _run_until(self, coord, direction, key, n=200):
-        for i in range(n):
-            coord = apply_direction(coord, direction)
-            if key(self.pond[coord]):
-                return coord
-
 
 
 def apply_direction(coord, direction):
-    # Returns a new coordinate with this distance applied to it.
+    # Returns a new coordinate with this distance applied to it. The pond
+    # itself steps around with Grid.neighbour, which knows about edges.
     x,y = coord
-    if direction == Direction.WEST:
-        dx, dy = -1, 0
-    elif direction == Direction.NORTHWEST:
-        dx, dy = -1, -1
-    elif direction == Direction.NORTH:
-        dx, dy = 0, -1
-    elif direction == Direction.NORTHEAST:
-        dx, dy = 1, -1
-    elif direction == Direction.EAST:
-        dx, dy = 1, 0
-    elif direction == Direction.SOUTHEAST:
-        dx, dy = 1, 1
-    elif direction == Direction.SOUTH:
-        dx, dy = 0, 1
-    elif direction == Direction.SOUTHWEST:
-        dx, dy = -1, 1
-
-    return (x + dx, y + dy)
+    return (x + DX[direction], y + DY[direction])
 
 
 
 class Cell(object):
+    # Cells are the bulk of the pond, so they don't carry a __dict__.
+    # Without energy validation, energy is a plain slot.
+    if VALIDATE_ENERGY:
+        __slots__ = ('_memory', '_colour', 'soul', 'debug', '_energy')
+    else:
+        __slots__ = ('_memory', '_colour', 'soul', 'debug', 'energy')
+
+    inanimate = False
+
     def __init__(self, energy=0, memory=None, soul=None, randomised=False):
         if not randomised:
             if memory is not None and soul is None:
                 soul = algae.random_soul()
 
             if memory is None:
-                memory = bitstring.BitStream(WORD_BITS * MEMORY_WORDS)
+                memory = algae.empty_memory()
+            else:
+                memory = algae.as_words(memory, copy=True)
             self.memory = memory
-            self.soul = soul 
+            self.soul = algae.as_soul(soul)
 
         else:
             try:
@@ -332,23 +794,39 @@ class Cell(object):
                 self.randomise(random=randomised)
                 self.soul = algae.random_soul(random=randomised)
 
-        self._energy = energy
+        self.energy = energy
         self.debug = False
-        self.inanimate = False
 
-    def get_energy(self):
-        return self._energy
-    def set_energy(self, value):
-        assert value >= 0
-        self._energy = value
+    if VALIDATE_ENERGY:
+        def get_energy(self):
+            return self._energy
+        def set_energy(self, value):
+            assert value >= 0
+            self._energy = value
+
+        energy = property(get_energy, set_energy)
+
+    # The colour is worked out from the memory, and only again once the
+    # memory has changed. Replacing the memory wholesale, or changing it
+    # with write_memory, is how it knows.
+    def get_memory(self):
+        return self._memory
+    def set_memory(self, memory):
+        self._memory = memory
+        self._colour = None
+
+    memory = property(get_memory, set_memory)
 
-    energy = property(get_energy, set_energy)
+    def write_memory(self, word_index, words):
+        self._memory[word_index:word_index + len(words)] = (
+            array.array(WORD_TYPECODE, words))
+        self._colour = None
 
     def __repr__(self):
         fmt = "<{name} soul={soul} energy={energy} colour={colour}>"
         name = self.__class__.__name__
         if self.soul is not None:
-            soul = ''.join(('0x', self.soul.hex))
+            soul = '0x{:08x}'.format(self.soul)
         else:
             soul = None
 
@@ -376,10 +854,7 @@ class Cell(object):
 
     @property
     def alive(self):
-        if self.inanimate:
-            return False
-        else:
-            return self.soul is not None
+        return self.soul is not None and not self.inanimate
 
     @property
     def checksum(self):
@@ -387,22 +862,224 @@ class Cell(object):
 
     @property
     def colour(self):
-        checksum = self.checksum
-        colour = [None, None, None, None]
-        for i in range(4):
-            colour[3 - i] = checksum & 0xFF
-            checksum >>= 8
-
-        assert None not in colour
-        return colour
+        if self._colour is None:
+            # The checksum's bytes, big end first, are the RGBA.
+            checksum = struct.pack('>I', self.checksum)
+            self._colour = tuple(bytearray(checksum))
+        return self._colour
 
 class SunCell(Cell):
-    def __init__(self):
-        Cell.__init__(self)
-        self.inanimate = True
+    __slots__ = ()
+
+    inanimate = True
 
     colour = (255,255,255,255)
 
+class TrunkportCell(Cell):
+    # Marks a trunkport. The pond keeps track of where it goes.
+    __slots__ = ()
+
+    inanimate = True
+
+    colour = (0,255,255,255)
+
+class StoredCell(Cell):
+    # A Cell whose memory is a slot in a memstore.MemoryStore. Setting its
+    # memory copies the words into the slot. The pond gives the slot back
+    # when it lets go of the cell, and it mustn't be used after that.
+    __slots__ = ('store', 'slot')
+
+    def __init__(self, store, *args, **kwargs):
+        self.store = store
+        self.slot = store.allocate()
+        self._memory = store.view(self.slot)
+        Cell.__init__(self, *args, **kwargs)
+
+    def set_memory(self, memory):
+        if memory is not self._memory:
+            self._memory[:] = algae.as_words(memory)
+        self._colour = None
+
+    memory = property(Cell.get_memory, set_memory)
+
+    def release(self):
+        self.store.release(self.slot)
+
+    def __reduce__(self):
+        return (_unstored_cell, (algae.as_words(self._memory, copy=True),
+                                 self.energy, self.soul, self.debug))
+
+def _unstored_cell(memory, energy, soul, debug):
+    # What a StoredCell comes back out of a pickle as.
+    cell = Cell(energy=energy)
+    cell.memory = memory
+    cell.soul = soul
+    cell.debug = debug
+    return cell
+
+class EmptyCell(object):
+    # Stands in for every cell that has never been touched. There is only
+    # one of these, EMPTY_CELL, and it can't be changed; the pond swaps in
+    # a real Cell before writing anything.
+    __slots__ = ()
+
+    memory = (0,) * MEMORY_WORDS
+    soul = None
+    energy = 0
+    debug = False
+    inanimate = False
+    alive = False
+    checksum = 0
+    colour = (0,0,0,0)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("the empty cell is immutable")
+
+    def __repr__(self):
+        return "<EmptyCell>"
+
+    def can_access(self, other):
+        # Having no soul, we only get at things that aren't alive either.
+        return not other.alive
+
+EMPTY_CELL = EmptyCell()
+
+class SumTree(object):
+    # A Fenwick tree: a list of numbers whose prefix sums can be had, and
+    # any of which can be changed, in O(log n). Only added to and taken
+    # away from at the end.
+    def __init__(self, values=()):
+        self.values = []
+        # 1-based; node i holds the sum of values (i - (i & -i), i].
+        self._tree = [0]
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _prefix(self, n):
+        # The sum of the first n values.
+        tree = self._tree
+        total = 0
+        while n:
+            total += tree[n]
+            n -= n & -n
+        return total
+
+    def append(self, value):
+        self.values.append(value)
+        n = len(self.values)
+        self._tree.append(value + self._prefix(n - 1) -
+                          self._prefix(n - (n & -n)))
+
+    def pop(self):
+        self._tree.pop()
+        return self.values.pop()
+
+    def set(self, position, value):
+        delta = value - self.values[position]
+        if not delta:
+            return
+        self.values[position] = value
+        tree = self._tree
+        node = position + 1
+        while node < len(tree):
+            tree[node] += delta
+            node += node & -node
+
+    def weight(self, weigh=None):
+        # The sum of every value, or weigh(len, sum) for a weigh that's
+        # linear in both, which gives each value a weight of its own.
+        total = self._prefix(len(self.values))
+        if weigh is None:
+            return total
+        return weigh(len(self.values), total)
+
+    def find(self, target, weigh=None):
+        # The first position where the running total of weights passes
+        # target.
+        tree = self._tree
+        n = len(self.values)
+        position = 0
+        step = 1
+        while step * 2 <= n:
+            step *= 2
+        while step:
+            node = position + step
+            if node <= n:
+                # The node covers step values.
+                weight = tree[node]
+                if weigh is not None:
+                    weight = weigh(step, weight)
+                if target >= weight:
+                    target -= weight
+                    position = node
+            step //= 2
+        return min(position, n - 1)
+
+class AliveSet(set):
+    # Pond.alive. The indexes are kept in a list as well, in no particular
+    # order, so that one can be picked without making a list of them all.
+    # Once key_by is called, each also has a key, in a SumTree alongside;
+    # indexes added since have a key of 0 until set_key, and are kept in
+    # unkeyed.
+    def __init__(self, indexes=()):
+        set.__init__(self)
+        self.indexes = []
+        self._positions = {}
+        self.keys = None
+        self.unkeyed = set()
+        for index in indexes:
+            self.add(index)
+
+    def add(self, index):
+        if index not in self._positions:
+            self._positions[index] = len(self.indexes)
+            self.indexes.append(index)
+            set.add(self, index)
+            if self.keys is not None:
+                self.keys.append(0)
+                self.unkeyed.add(index)
+
+    def discard(self, index):
+        position = self._positions.pop(index, None)
+        if position is None:
+            return
+        # The last one fills the gap.
+        last = self.indexes.pop()
+        if self.keys is not None:
+            last_key = self.keys.pop()
+            self.unkeyed.discard(index)
+        if last != index:
+            self.indexes[position] = last
+            self._positions[last] = position
+            if self.keys is not None:
+                self.keys.set(position, last_key)
+        set.discard(self, index)
+
+    def key_by(self, keys):
+        # keys goes with indexes, in the same order.
+        self.keys = SumTree(keys)
+        self.unkeyed = set()
+
+    def set_key(self, index, key):
+        self.keys.set(self._positions[index], key)
+
+    def remove(self, index):
+        if index not in self._positions:
+            raise KeyError(index)
+        self.discard(index)
+
+    def __reduce__(self):
+        return (self.__class__, (self.indexes,))
+
+class LazyPond(dict):
+    # Looking up a cell that has never been touched gives EMPTY_CELL,
+    # without storing anything.
+    def __missing__(self, index):
+        return EMPTY_CELL
+
 def pond_time():
     pond = Pond()
     N = 0
@@ -417,14 +1094,17 @@ def _main():
     parser.add_argument('filename')
     parser.add_argument('-n','--number-of-ticks',type=int,default=10000,
                         dest='N')
+    parser.add_argument('-b','--boundary',default='WRAP',
+                        choices=[b.name for b in Boundary])
 
     namespace = parser.parse_args()
 
-    _realmain(namespace.N, namespace.filename)
+    _realmain(namespace.N, namespace.filename,
+              boundary=Boundary[namespace.boundary])
 
-def _realmain(N, filename):
+def _realmain(N, filename, boundary=Boundary.WRAP):
     assert os.path.exists(filename)
-    pond = Pond()
+    pond = Pond(boundary=boundary)
     with open(filename) as f:
         txt = f.read()
     memory, instructions = algae.multiline_parse(txt)
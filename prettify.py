@@ -15,15 +15,55 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import argparse
+import sys
 
 import algae
+
+# Disassemble algae. Give it source files to see what they assemble to, or
+# a headless checkpoint (-c) to dump every distinct genome living in it.
+
+def _checkpoint_genomes(path):
+    import headless
+    the_pond, tick = headless.load_checkpoint(path)
+    seen = set()
+    for index in sorted(the_pond.occupied):
+        cell = the_pond.pond[index]
+        key = cell.memory.tobytes()
+        if key in seen:
+            continue
+        seen.add(key)
+        yield ('{} tick {} at {} soul 0x{:08x}'.format(
+            path, tick, the_pond.grid.coord(index), cell.soul), cell.memory)
+
+def _source_genomes(filenames):
+    for filename in filenames:
+        with open(filename) as f:
+            memory, instructions = algae.multiline_parse(f.read())
+        yield filename, memory
+
 def _main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('filename')
+    parser.add_argument('filenames', nargs='*')
+    parser.add_argument('-c','--checkpoint',default=None)
+    parser.add_argument('-o','--output',default=None)
     ns = parser.parse_args()
-    with open(ns.filename) as f:
-        memory = algae.multiline_parse(f.read())
-    print(algae.pretty_print_memory(memory,colour=True))
+
+    if ns.checkpoint is None and len(ns.filenames) == 1:
+        with open(ns.filenames[0]) as f:
+            memory, instructions = algae.multiline_parse(f.read())
+        print(algae.pretty_print_memory(memory))
+        return
+
+    output = sys.stdout
+    if ns.output is not None:
+        output = open(ns.output, 'w')
+    try:
+        algae.dump_genomes(_source_genomes(ns.filenames), output)
+        if ns.checkpoint is not None:
+            algae.dump_genomes(_checkpoint_genomes(ns.checkpoint), output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
 
 if __name__=='__main__':
     _main()
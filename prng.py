@@ -0,0 +1,188 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from constants import *
+
+# Where the pond's random numbers come from. Both kinds are splitmix64,
+# which is a counter put through a mixing function:
+#
+#   random_word(seed) is RANDOM's answer for a seed. It's the mix of the
+#   seed alone, so there's nothing to set up; algae_core.c and lockstep.py
+#   work it out the same way.
+#
+#   Stream is what a pond draws from, to schedule cells, place them and
+#   fill in their memories. It's a random.Random, so choice, sample and
+#   the rest all work, and its whole state is one number. words draws a
+#   lot at once, with numpy when there is numpy.
+#
+# Ponds used to use Python's random for both, seeding a Mersenne Twister
+# for every RANDOM. set_compatible(True) goes back to that, so seeds give
+# the runs they always did. It's for the whole process, and has to be
+# set before any ponds are made.
+
+MASK64 = 2**64 - 1
+GOLDEN_GAMMA = 0x9e3779b97f4a7c15
+
+compatible = False
+
+def set_compatible(flag):
+    global compatible
+    compatible = bool(flag)
+
+def mix64(z):
+    # splitmix64's finaliser; z is taken mod 2**64.
+    z &= MASK64
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK64
+    return z ^ (z >> 31)
+
+def random_word(seed):
+    # A word that depends only on seed.
+    if compatible:
+        return random.Random(seed).randint(0, MAX_INT - 1)
+    return mix64(seed + GOLDEN_GAMMA) >> (64 - WORD_BITS)
+
+def random_word_array(seeds):
+    # random_word for each of a numpy array of seeds, as uint64s.
+    if compatible:
+        return numpy.array([random.Random(seed).randint(0, MAX_INT - 1)
+                            for seed in seeds.tolist()], dtype=numpy.uint64)
+    return _mix64_array(seeds.astype(numpy.uint64) +
+                        numpy.uint64(GOLDEN_GAMMA)) >> numpy.uint64(
+                            64 - WORD_BITS)
+
+def _mix64_array(z):
+    # mix64 for a uint64 array, which wraps the way mix64 masks.
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+    return z ^ (z >> numpy.uint64(31))
+
+def pond_random(seed=None):
+    # What a new pond should draw from.
+    if compatible:
+        return random.Random(seed)
+    return Stream(seed)
+
+class Stream(random.Random):
+    # The n-th number drawn after seeding with s is mix64(s + n*GOLDEN_GAMMA),
+    # so the state is just how far along that is: counter. With numpy,
+    # numbers are worked out BLOCK at a time, ahead of being drawn.
+    VERSION = 'splitmix64'
+    BLOCK = 256
+
+    def seed(self, a=None, version=2):
+        if a is None:
+            a = random.SystemRandom().getrandbits(64)
+        self._seek(int(a))
+        self.gauss_next = None
+
+    def _seek(self, counter):
+        # Worked out but not drawn yet, last first, and the counter of the
+        # last of them.
+        self._ahead = []
+        self._ahead_counter = counter & MASK64
+
+    @property
+    def counter(self):
+        return (self._ahead_counter -
+                len(self._ahead) * GOLDEN_GAMMA) & MASK64
+
+    def getstate(self):
+        return (self.VERSION, self.counter, self.gauss_next)
+
+    def setstate(self, state):
+        if state[0] != self.VERSION:
+            raise ValueError("not a Stream's state: {!r}".format(state))
+        counter, self.gauss_next = state[1:]
+        self._seek(counter)
+
+    def next64(self):
+        try:
+            return self._ahead.pop()
+        except IndexError:
+            pass
+        if numpy is None:
+            self._ahead_counter = counter = ((self._ahead_counter +
+                                              GOLDEN_GAMMA) & MASK64)
+            return mix64(counter)
+        ahead = self._draw_array(self.BLOCK).tolist()
+        ahead.reverse()
+        self._ahead = ahead
+        return ahead.pop()
+
+    def _draw_array(self, n):
+        # The next n numbers, as a uint64 array, with nothing worked out
+        # ahead.
+        counter = self.counter
+        steps = numpy.arange(1, n + 1, dtype=numpy.uint64)
+        counters = numpy.uint64(counter) + steps * numpy.uint64(GOLDEN_GAMMA)
+        self._seek(counter + n * GOLDEN_GAMMA)
+        return _mix64_array(counters)
+
+    # These take from what's worked out ahead themselves, rather than
+    # through next64, which saves a call on nearly every draw. _randbelow
+    # is what choice, randrange and sample pick with; it gives what
+    # random.Random's would from getrandbits, without calling it.
+    def _randbelow(self, n):
+        k = n.bit_length()
+        if k > 64:
+            r = self.getrandbits(k)
+            while r >= n:
+                r = self.getrandbits(k)
+            return r
+        ahead = self._ahead
+        shift = 64 - k
+        while True:
+            r = (ahead.pop() if ahead else self.next64()) >> shift
+            if r < n:
+                return r
+
+    def random(self):
+        try:
+            return (self._ahead.pop() >> 11) * (1.0 / 2**53)
+        except IndexError:
+            return (self.next64() >> 11) * (1.0 / 2**53)
+
+    def getrandbits(self, k):
+        if 0 <= k <= 64:
+            try:
+                return self._ahead.pop() >> (64 - k)
+            except IndexError:
+                return self.next64() >> (64 - k)
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        bits = 0
+        for shift in range(0, k, 64):
+            bits |= self.next64() << shift
+        return bits & ((1 << k) - 1)
+
+    def words(self, n):
+        # The next n numbers, as an array of words: each one's top bits.
+        shift = 64 - WORD_BITS
+        if numpy is None:
+            return array.array(WORD_TYPECODE, [self.next64() >> shift
+                                               for i in range(n)])
+        words = self._draw_array(n) >> numpy.uint64(shift)
+        return array.array(WORD_TYPECODE,
+                           words.astype(numpy.uint32).tobytes())
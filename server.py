@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import asyncio
+import json
+import time
+
+import algae
+import analytics
+import pond as pond_module
+import prng
+from constants import *
+
+# Runs a pond and answers questions about it over a socket, while it runs.
+# Requests and responses are JSON, one object per line:
+#
+#   {"command": "cell", "x": 10, "y": 20}
+#   {"command": "genome", "x": 10, "y": 20}
+#   {"command": "metrics"}
+#   {"command": "snapshot"}
+#   {"command": "spawn", "code": "...algae source...", "x": 1, "y": 2}
+#   {"command": "lightning", "count": 10}
+#   {"command": "pause"} / {"command": "resume"}
+#   {"command": "step", "ticks": 100}
+#
+# Each response is one line, except snapshots, which come as a line per
+# SNAPSHOT_CHUNK cells and then {"end": true, "count": cells}.
+#
+# The simulation runs in the same event loop, a batch of ticks at a time;
+# a batch stops once it's taken BATCH_SECONDS, so a query waits no longer
+# than that to be answered. Steps are run in batches too. A cell can run a
+# long way in one tick unless the pond has a quantum (-q).
+
+BATCH_SECONDS = 0.01
+SNAPSHOT_CHUNK = 1024
+
+class PondServer(object):
+    def __init__(self, pond, batch_seconds=BATCH_SECONDS):
+        self.pond = pond
+        self.analytics = analytics.Analytics(pond)
+        self.batch_seconds = batch_seconds
+        self.tick = 0
+        self.paused = False
+        self.started = time.time()
+
+    def run_batch(self, most=None):
+        # Tick until the time's up, or most ticks have been run; always at
+        # least once. Returns how many were.
+        pond = self.pond
+        end = time.time() + self.batch_seconds
+        ran = 0
+        while True:
+            pond.tick(self.tick)
+            self.tick += 1
+            ran += 1
+            if time.time() >= end or ran == most:
+                return ran
+
+    async def simulate(self):
+        while True:
+            if self.paused:
+                await asyncio.sleep(self.batch_seconds)
+            else:
+                self.run_batch()
+                # Give the connections a turn.
+                await asyncio.sleep(0)
+
+    def _index(self, request):
+        coord = (int(request['x']), int(request['y']))
+        if not self.pond.grid.contains(coord):
+            raise ValueError("{} is outside the pond".format(coord))
+        return self.pond.grid.index(coord)
+
+    def _coord(self, request):
+        if 'x' in request or 'y' in request:
+            return (int(request['x']), int(request['y']))
+        return None
+
+    def cell(self, request):
+        index = self._index(request)
+        cell = self.pond.pond[index]
+        return {
+            'x': request['x'], 'y': request['y'],
+            'soul': cell.soul,
+            'energy': cell.energy,
+            'alive': cell.alive,
+            'inanimate': cell.inanimate,
+            'checksum': cell.checksum,
+            'light': self.pond.light_level[index],
+        }
+
+    def genome(self, request):
+        cell = self.pond.pond[self._index(request)]
+        return {'x': request['x'], 'y': request['y'],
+                'lines': algae.disassemble(cell.memory)}
+
+    def metrics(self, request):
+        metrics = self.analytics.summary()
+        metrics.update({
+            'tick': self.tick,
+            'paused': self.paused,
+            'instructions': self.pond.instructions,
+            'uptime': round(time.time() - self.started, 3),
+            'top_colonies': [[cells, energy, soul] for cells, energy, soul
+                             in self.analytics.top_colonies(5)],
+        })
+        return metrics
+
+    def spawn(self, request):
+        memory, instructions = algae.multiline_parse(request['code'])
+        self.pond.spawn(memory=memory, soul=request.get('soul'),
+                        coord=self._coord(request))
+        return {'spawned': instructions}
+
+    def lightning(self, request):
+        count = int(request.get('count', 1))
+        for i in range(count):
+            self.pond.lightning(coord=self._coord(request))
+        return {'lightning': count}
+
+    def pause(self, request):
+        self.paused = True
+        return {'paused': True}
+
+    def resume(self, request):
+        self.paused = False
+        return {'paused': False}
+
+    async def step(self, request):
+        # Only makes sense when paused; otherwise it's just more ticks.
+        ticks = int(request.get('ticks', 1))
+        while ticks > 0:
+            ticks -= self.run_batch(most=ticks)
+            await asyncio.sleep(0)
+        return {'tick': self.tick}
+
+    def snapshot_rows(self):
+        # Every occupied cell, as [x, y, soul, energy, checksum]. Taken all
+        # at once, so the snapshot is of one moment, even though it's sent
+        # a bit at a time.
+        pond = self.pond
+        rows = []
+        for index in sorted(pond.occupied):
+            cell = pond.pond[index]
+            x, y = pond.grid.coord(index)
+            rows.append([x, y, cell.soul, cell.energy, cell.checksum])
+        return rows
+
+    COMMANDS = ('cell', 'genome', 'metrics', 'spawn', 'lightning', 'pause',
+                'resume')
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    command = request['command']
+                    if command == 'snapshot':
+                        await self._stream_snapshot(writer)
+                        continue
+                    if command == 'step':
+                        response = await self.step(request)
+                    elif command in self.COMMANDS:
+                        response = getattr(self, command)(request)
+                    else:
+                        raise ValueError("unknown command {!r}".format(
+                            command))
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {'error': str(e)}
+                await _send(writer, response)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _stream_snapshot(self, writer):
+        rows = self.snapshot_rows()
+        header = {'tick': self.tick, 'size': list(self.pond.grid.size),
+                  'fields': ['x', 'y', 'soul', 'energy', 'checksum']}
+        await _send(writer, header)
+        for start in range(0, len(rows), SNAPSHOT_CHUNK):
+            await _send(writer, {'cells': rows[start:start + SNAPSHOT_CHUNK]})
+        await _send(writer, {'end': True, 'count': len(rows)})
+
+async def _send(writer, record):
+    writer.write(json.dumps(record).encode('utf-8') + b'\n')
+    # Waits for the other end if it's slow, letting the pond carry on.
+    await writer.drain()
+
+async def serve(pond_server, unix=None, host='127.0.0.1', port=7461):
+    if unix is not None:
+        server = await asyncio.start_unix_server(pond_server.handle, unix)
+    else:
+        server = await asyncio.start_server(pond_server.handle, host, port)
+    simulation = asyncio.ensure_future(pond_server.simulate())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        simulation.cancel()
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def _main():
+    parser = argparse.ArgumentParser(description="Serve a running pond.")
+    parser.add_argument('genomes', nargs='*')
+    parser.add_argument('-s','--seed',type=int,default=None)
+    parser.add_argument('--size',type=_parse_size,default=(640,480))
+    parser.add_argument('-b','--boundary',default='WRAP',
+                        choices=[b.name for b in Boundary])
+    parser.add_argument('-l','--lightning',type=int,default=0)
+    parser.add_argument('-u','--unix',default=None,
+                        help="listen on this Unix socket, not TCP")
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('-p','--port',type=int,default=7461)
+    parser.add_argument('--paused',action='store_true')
+    parser.add_argument('-q','--quantum',type=int,default=None,
+                        help="instructions a cell runs before it's put aside")
+    parser.add_argument('--compatible-random',action='store_true',
+                        help="random numbers as before prng.py, so old "
+                        "seeds run as they did")
+    ns = parser.parse_args()
+    prng.set_compatible(ns.compatible_random)
+
+    pond = pond_module.Pond(size=ns.size, boundary=Boundary[ns.boundary])
+    if ns.seed is not None:
+        pond._random.seed(ns.seed)
+    for filename in ns.genomes:
+        with open(filename) as f:
+            memory, instructions = algae.multiline_parse(f.read())
+        pond.spawn(memory=memory)
+    for i in range(ns.lightning):
+        pond.lightning()
+    pond.quantum = ns.quantum
+
+    pond_server = PondServer(pond)
+    pond_server.paused = ns.paused
+    try:
+        asyncio.run(serve(pond_server, unix=ns.unix, host=ns.host,
+                          port=ns.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__=='__main__':
+    _main()
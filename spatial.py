@@ -0,0 +1,107 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import collections
+
+from constants import *
+
+ROW = 0
+COLUMN = 1
+DIAGONAL = 2 # Runs NORTHWEST to SOUTHEAST.
+ANTIDIAGONAL = 3 # Runs NORTHEAST to SOUTHWEST.
+
+def _line_kind(direction):
+    dx, dy = DX[direction], DY[direction]
+    if dy == 0:
+        return ROW
+    elif dx == 0:
+        return COLUMN
+    elif dx == dy:
+        return DIAGONAL
+    else:
+        return ANTIDIAGONAL
+
+# Which kind of line a LADAR beam in each direction travels along, and
+# whether it travels towards bigger positions on that line.
+LINE_KINDS = tuple(_line_kind(d) for d in range(DIRECTIONS))
+FORWARDS = tuple((DY[d] if LINE_KINDS[d] == COLUMN else DX[d]) > 0
+                 for d in range(DIRECTIONS))
+
+class OccupancyIndex(object):
+    # Every occupied index, filed under each of the four lines running
+    # through it (its row, column and both diagonals). Each line keeps a
+    # sorted list of positions along it, so the first occupied cell along
+    # a beam is a binary search away, however empty the pond is.
+    def __init__(self, grid):
+        self.grid = grid
+        self.occupied = set()
+        self.lines = [collections.defaultdict(list) for kind in range(4)]
+
+    def _keys(self, index):
+        # (line, position along the line) for each kind of line.
+        y, x = divmod(index, self.grid.width)
+        return ((y, x), (x, y), (x - y, x), (x + y, x))
+
+    def __contains__(self, index):
+        return index in self.occupied
+
+    def __len__(self):
+        return len(self.occupied)
+
+    def __iter__(self):
+        return iter(self.occupied)
+
+    def add(self, index):
+        if index in self.occupied:
+            return
+        self.occupied.add(index)
+        for lines, (line, position) in zip(self.lines, self._keys(index)):
+            bisect.insort(lines[line], position)
+
+    def discard(self, index):
+        if index not in self.occupied:
+            return
+        self.occupied.remove(index)
+        for lines, (line, position) in zip(self.lines, self._keys(index)):
+            positions = lines[line]
+            del positions[bisect.bisect_left(positions, position)]
+            if not positions:
+                del lines[line]
+
+    def first(self, index, direction, n):
+        # The first occupied index in the (up to) n cells in direction from
+        # index, or None. Agrees with walking grid.ray(index, direction, n).
+        kind = LINE_KINDS[direction]
+        forwards = FORWARDS[direction]
+        lines = self.lines[kind]
+        offset = self.grid.offsets[direction]
+
+        for first, count in self.grid.runs(index, direction, n):
+            line, start = self._keys(first)[kind]
+            positions = lines.get(line)
+            if not positions:
+                continue
+
+            if forwards:
+                i = bisect.bisect_left(positions, start)
+                if i < len(positions) and positions[i] < start + count:
+                    return first + offset * (positions[i] - start)
+            else:
+                i = bisect.bisect_right(positions, start) - 1
+                if i >= 0 and positions[i] > start - count:
+                    return first + offset * (start - positions[i])
+        return None
@@ -0,0 +1,260 @@
+#    PondALGAE - A simulated networked life simulation
+#    Copyright (C) 2013  Jack Edge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import environment
+from constants import *
+
+# The per-index state of a tiled pond (Pond(tiled=True)), for worlds far
+# too big to keep an array entry for every index, where life is sparse.
+#
+# The grid is cut into TILE_SIZE square tiles. A tile gets a Block, which
+# holds its soul ids and birth ticks as arrays, when the first soul is born
+# in it, and the Block is let go of when the last one dies. Indexes in
+# tiles without a Block read as 0. Light is worked out for a Block the
+# first time it's asked for, and forgotten whenever a sun changes within
+# reach of it; anywhere else it's worked out for the one index. Everything
+# else a cell can smell about where it is gets worked out when it's
+# sniffed. So memory goes with the number of tiles with life in them, not
+# with the size of the pond.
+#
+# Cells themselves are already only kept where there are any (LazyPond),
+# and so are the occupancy index and ethers.
+
+TILE_SIZE = 64
+
+class Block(object):
+    __slots__ = ('souls', 'soul_ids', 'born', 'light')
+
+    def __init__(self, tile_size):
+        # How many indexes in the tile have a soul.
+        self.souls = 0
+        self.soul_ids = array.array('i', [0]) * (tile_size * tile_size)
+        self.born = array.array('l', [0]) * (tile_size * tile_size)
+        self.light = None
+
+class Tiles(object):
+    def __init__(self, grid, tile_size=TILE_SIZE):
+        self.grid = grid
+        self.tile_size = tile_size
+        # Tiles across the grid; the last ones may hang over the edge.
+        self.across = -(-grid.width // tile_size)
+        # {tile: Block}
+        self.blocks = {}
+        self.soul_ids = SoulIds(self)
+        self.born = Born(self)
+
+    def locate(self, index):
+        # (tile, offset of index within the tile's arrays)
+        y, x = divmod(index, self.grid.width)
+        size = self.tile_size
+        return ((y // size) * self.across + x // size,
+                (y % size) * size + x % size)
+
+    def bounds(self, tile):
+        # The tile's x and y ranges, clipped to the grid.
+        size = self.tile_size
+        row, column = divmod(tile, self.across)
+        return ((column * size, min(self.grid.width, (column + 1) * size)),
+                (row * size, min(self.grid.height, (row + 1) * size)))
+
+    def __len__(self):
+        return len(self.blocks)
+
+class SoulIds(object):
+    # Pond.soul_ids. Writing the first soul into a tile makes its Block, and
+    # writing over the last one gets rid of it.
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    def __len__(self):
+        return self.tiles.grid.area
+
+    def __getitem__(self, index):
+        tile, offset = self.tiles.locate(index)
+        block = self.tiles.blocks.get(tile)
+        if block is None:
+            return 0
+        return block.soul_ids[offset]
+
+    def __setitem__(self, index, soul_id):
+        tiles = self.tiles
+        tile, offset = tiles.locate(index)
+        block = tiles.blocks.get(tile)
+        if block is None:
+            if not soul_id:
+                return
+            block = tiles.blocks[tile] = Block(tiles.tile_size)
+        block.souls += bool(soul_id) - bool(block.soul_ids[offset])
+        block.soul_ids[offset] = soul_id
+        if not block.souls:
+            del tiles.blocks[tile]
+
+class Born(object):
+    # Pond.born. Only kept where there's a Block; nowhere else has a soul
+    # for it to matter.
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    def __len__(self):
+        return self.tiles.grid.area
+
+    def __getitem__(self, index):
+        tile, offset = self.tiles.locate(index)
+        block = self.tiles.blocks.get(tile)
+        if block is None:
+            return 0
+        return block.born[offset]
+
+    def __setitem__(self, index, tick):
+        tile, offset = self.tiles.locate(index)
+        block = self.tiles.blocks.get(tile)
+        if block is not None:
+            block.born[offset] = tick
+
+class Light(object):
+    # Pond.light_level, for a TiledEnvironment.
+    def __init__(self, environment):
+        self.environment = environment
+
+    def __len__(self):
+        return self.environment.grid.area
+
+    def __getitem__(self, index):
+        tiles = self.environment.tiles
+        tile, offset = tiles.locate(index)
+        block = tiles.blocks.get(tile)
+        if block is None:
+            return self.environment.index_light(index)
+        if block.light is None:
+            block.light = self.environment.tile_light(tile)
+        return block.light[offset]
+
+class TiledEnvironment(object):
+    # Does what environment.Environment does, without its tables, and gives
+    # the same answers: each sun's share of the light is summed exactly, so
+    # it doesn't matter what's added up in what order.
+    def __init__(self, tiles, cutoff=None):
+        self.tiles = tiles
+        self.grid = tiles.grid
+        self.cutoff = cutoff
+        # {index: brightness}
+        self.suns = {}
+        self.light = Light(self)
+
+    def scent(self, scent, index):
+        if scent == Scent.LIGHT_LEVEL:
+            return self.light[index]
+        elif scent in (Scent.SUN_DISTANCE, Scent.SUN_DIRECTION):
+            sun, distance, direction = environment.nearest_sun(
+                self.grid, self.suns, index)
+            if scent == Scent.SUN_DISTANCE:
+                return distance
+            return direction
+        else:
+            distance, direction, level = environment.edge_scents(self.grid,
+                                                                 index)
+            if scent == Scent.EDGE_DISTANCE:
+                return distance
+            elif scent == Scent.EDGE_DIRECTION:
+                return direction
+            return level
+
+    def add_sun(self, index, brightness=SUN_MAX_BRIGHTNESS):
+        if index in self.suns:
+            raise ValueError("there's already a sun at {}".format(index))
+        self.suns[index] = brightness
+        self._forget_light(index)
+
+    def remove_sun(self, index):
+        del self.suns[index]
+        self._forget_light(index)
+
+    def move_sun(self, index, new_index):
+        if new_index == index:
+            return
+        if new_index in self.suns:
+            raise ValueError("there's already a sun at {}".format(new_index))
+        self.suns[new_index] = self.suns.pop(index)
+        self._forget_light(index)
+        self._forget_light(new_index)
+
+    def set_brightness(self, index, brightness):
+        self.suns[index] = brightness
+        self._forget_light(index)
+
+    def _reach(self, sun):
+        # The x and y ranges a sun lights.
+        grid = self.grid
+        if self.cutoff is None:
+            return (0, grid.width), (0, grid.height)
+        sun_x, sun_y = grid.coord(sun)
+        return ((sun_x - self.cutoff, sun_x + self.cutoff + 1),
+                (sun_y - self.cutoff, sun_y + self.cutoff + 1))
+
+    def _forget_light(self, sun):
+        (x0, x1), (y0, y1) = self._reach(sun)
+        tiles = self.tiles
+        for tile, block in tiles.blocks.items():
+            (tx0, tx1), (ty0, ty1) = tiles.bounds(tile)
+            if tx0 < x1 and x0 < tx1 and ty0 < y1 and y0 < ty1:
+                block.light = None
+
+    def index_light(self, index):
+        reach = None
+        if self.cutoff is not None:
+            reach = self.cutoff * self.cutoff
+        y, x = divmod(index, self.grid.width)
+        total = 0.0
+        for sun, brightness in self.suns.items():
+            sun_x, sun_y = self.grid.coord(sun)
+            distance_squared = (sun_x - x) ** 2 + (sun_y - y) ** 2
+            if reach is None or distance_squared <= reach:
+                total += environment.sun_light(distance_squared, brightness)
+        return int(total)
+
+    def tile_light(self, tile):
+        # The light over a whole tile, in the tile's own order.
+        tiles = self.tiles
+        size = tiles.tile_size
+        (x0, x1), (y0, y1) = tiles.bounds(tile)
+        light = array.array('I', [0]) * (size * size)
+        if numpy is None:
+            width = self.grid.width
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    light[(y - y0) * size + (x - x0)] = self.index_light(
+                        y * width + x)
+            return light
+
+        dx = numpy.arange(x0, x1, dtype=numpy.int64)
+        dy = numpy.arange(y0, y1, dtype=numpy.int64)
+        sums = numpy.zeros((y1 - y0, x1 - x0))
+        for sun, brightness in self.suns.items():
+            sun_x, sun_y = self.grid.coord(sun)
+            distance_squared = ((dy - sun_y)[:, None] ** 2 +
+                                (dx - sun_x)[None, :] ** 2)
+            sums += environment.sun_light_array(distance_squared,
+                                                brightness, self.cutoff)
+        view = numpy.frombuffer(light, dtype=numpy.uint32).reshape(size, size)
+        view[:y1 - y0, :x1 - x0] = sums
+        return light